@@ -0,0 +1,256 @@
+# admission.py
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+ADMISSION_INTERACTIVE_CONCURRENCY = int(os.getenv("ADMISSION_INTERACTIVE_CONCURRENCY", "8"))  # Real-time requests in flight
+ADMISSION_INTERACTIVE_MEMORY_MB = float(os.getenv("ADMISSION_INTERACTIVE_MEMORY_MB", "256"))  # Memory budget of real-time work
+ADMISSION_INTERACTIVE_QUEUE = int(os.getenv("ADMISSION_INTERACTIVE_QUEUE", "0"))  # Real-time requests allowed to wait
+ADMISSION_BULK_CONCURRENCY = int(os.getenv("ADMISSION_BULK_CONCURRENCY", "2"))  # Video/batch jobs in flight
+ADMISSION_BULK_MEMORY_MB = float(os.getenv("ADMISSION_BULK_MEMORY_MB", "1024"))  # Memory budget of bulk work
+ADMISSION_BULK_QUEUE = int(os.getenv("ADMISSION_BULK_QUEUE", "8"))  # Bulk jobs waiting for a slot before rejecting
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", "30"))  # Longest wait in the queue
+ADMISSION_MEMORY_FACTOR = float(os.getenv("ADMISSION_MEMORY_FACTOR", "4"))  # Decoded/working memory per uploaded image byte
+
+# Priorities of the inference lock
+INTERACTIVE = 0
+BULK = 1
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request exceeds its class limits; carries Retry-After."""
+
+    def __init__(self, workload: str, reason: str, retry_after: int):
+        super().__init__(f"{workload} capacity exceeded ({reason}), retry after {retry_after}s")
+        self.workload = workload
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class PriorityLock:
+    """
+    Mutex for the shared model. When it is released, waiting interactive
+    callers are always served before bulk ones, so a video job yields the
+    model to live frames between its batches. hold() blocks the calling
+    thread, so async endpoints acquire it from an executor thread.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._held = False
+        self._waiting = [0, 0]  # by priority
+        self.acquisitions = [0, 0]
+        self.handoffs = 0  # releases that passed the model to interactive work over waiting bulk work
+        self.wait_time = [0.0, 0.0]
+
+    @contextmanager
+    def hold(self, priority: int = INTERACTIVE):
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while self._held or (priority == BULK and self._waiting[INTERACTIVE]):
+                    self._cond.wait()
+            finally:
+                self._waiting[priority] -= 1
+            self._held = True
+            self.acquisitions[priority] += 1
+            self.wait_time[priority] += time.monotonic() - start
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._held = False
+                if self._waiting[INTERACTIVE] and self._waiting[BULK]:
+                    self.handoffs += 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = {
+                name: {
+                    "acquisitions": self.acquisitions[p],
+                    "waiting": self._waiting[p],
+                    "avg_wait_ms": 1000 * self.wait_time[p] / self.acquisitions[p] if self.acquisitions[p] else 0.0,
+                }
+                for name, p in (("interactive", INTERACTIVE), ("bulk", BULK))
+            }
+            stats["handoffs_to_interactive"] = self.handoffs
+            return stats
+
+
+class _WorkloadClass:
+    def __init__(self, name: str, concurrency: int, memory_mb: float, queue_limit: int):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.memory_budget = int(memory_mb * 1024 * 1024)
+        self.queue_limit = max(0, queue_limit)
+        self.active = 0
+        self.memory = 0
+        self.waiters = deque()  # (future, cost)
+
+        self.admitted = 0
+        self.queued = 0
+        self.queue_admitted = 0
+        self.rejected: Dict[str, int] = {}
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.completed = 0
+        self.busy_time = 0.0
+
+    def fits(self, cost: int) -> bool:
+        return self.active < self.concurrency and (self.active == 0 or self.memory + cost <= self.memory_budget)
+
+    def take(self, cost: int):
+        self.active += 1
+        self.memory += cost
+
+    def prune(self):
+        """Forget queued requests that timed out or were cancelled."""
+        if any(future.done() for future, _ in self.waiters):
+            self.waiters = deque(w for w in self.waiters if not w[0].done())
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from the average job duration."""
+        avg = self.busy_time / self.completed if self.completed else 1.0
+        backlog = len(self.waiters) + 1
+        return max(1, min(300, math.ceil(avg * backlog / self.concurrency)))
+
+    def reject(self, reason: str) -> AdmissionRejected:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        logger.warning(f"🚦 Rejected {self.name} request: {reason} ({self.active} active, {len(self.waiters)} queued)")
+        return AdmissionRejected(self.name, reason, self.retry_after())
+
+
+class Ticket:
+    def __init__(self, workload: _WorkloadClass, cost: int, loop: asyncio.AbstractEventLoop):
+        self.workload = workload
+        self.cost = cost
+        self.loop = loop
+        self.started = time.monotonic()
+        self.released = False
+
+
+class AdmissionController:
+    """
+    Per-class admission control.
+
+    Interactive work (single frames) and bulk work (videos, batches) each
+    have a concurrency limit and a memory budget, estimated from the upload
+    size. Interactive requests over the limit are rejected at once; bulk
+    requests wait in a bounded FIFO queue and are rejected when it is full
+    or the wait times out. A request larger than the whole budget still
+    runs, but only alone. Rejections carry a Retry-After estimate.
+    """
+
+    def __init__(self):
+        self.classes = {
+            "interactive": _WorkloadClass(
+                "interactive", ADMISSION_INTERACTIVE_CONCURRENCY,
+                ADMISSION_INTERACTIVE_MEMORY_MB, ADMISSION_INTERACTIVE_QUEUE
+            ),
+            "bulk": _WorkloadClass(
+                "bulk", ADMISSION_BULK_CONCURRENCY, ADMISSION_BULK_MEMORY_MB, ADMISSION_BULK_QUEUE
+            ),
+        }
+        self.queue_timeout = ADMISSION_QUEUE_TIMEOUT_S
+
+    async def acquire(self, workload: str, cost: int = 0) -> Ticket:
+        """Admit a request or raise AdmissionRejected; must be released with release()."""
+        c = self.classes[workload]
+        cost = max(0, int(cost))
+        loop = asyncio.get_running_loop()
+        c.prune()
+        if not c.waiters and c.fits(cost):
+            c.take(cost)
+            c.admitted += 1
+            return Ticket(c, cost, loop)
+        if len(c.waiters) >= c.queue_limit:
+            if c.queue_limit:
+                raise c.reject("queue full")
+            raise c.reject("memory" if c.active < c.concurrency else "concurrency")
+
+        future = loop.create_future()
+        c.waiters.append((future, cost))
+        c.queued += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise c.reject("queue timeout")
+        except asyncio.CancelledError:
+            # Client went away; give back a slot that was granted meanwhile
+            if future.done() and not future.cancelled():
+                self._release(Ticket(c, cost, loop))
+            raise
+        waited = time.monotonic() - start
+        c.wait_time += waited
+        c.max_wait = max(c.max_wait, waited)
+        c.queue_admitted += 1
+        c.admitted += 1
+        return Ticket(c, cost, loop)
+
+    def release(self, ticket: Optional[Ticket]):
+        """Return a slot; safe to call from any thread (e.g. streaming generators)."""
+        if ticket is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is ticket.loop:
+            self._release(ticket)
+        else:
+            ticket.loop.call_soon_threadsafe(self._release, ticket)
+
+    def _release(self, ticket: Ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+        c = ticket.workload
+        c.active -= 1
+        c.memory -= ticket.cost
+        c.completed += 1
+        c.busy_time += time.monotonic() - ticket.started
+        # Hand freed capacity to queued requests in arrival order
+        while c.waiters:
+            future, cost = c.waiters[0]
+            if future.done():  # timed out or cancelled
+                c.waiters.popleft()
+                continue
+            if not c.fits(cost):
+                break
+            c.waiters.popleft()
+            c.take(cost)
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "active": c.active,
+                "concurrency": c.concurrency,
+                "memory_mb": round(c.memory / (1024 * 1024), 1),
+                "memory_budget_mb": round(c.memory_budget / (1024 * 1024), 1),
+                "queued_now": sum(1 for future, _ in c.waiters if not future.done()),
+                "queue_limit": c.queue_limit,
+                "admitted": c.admitted,
+                "queued": c.queued,
+                "rejected": dict(c.rejected),
+                "avg_queue_wait_ms": 1000 * c.wait_time / c.queue_admitted if c.queue_admitted else 0.0,
+                "max_queue_wait_ms": 1000 * c.max_wait,
+                "avg_duration_s": c.busy_time / c.completed if c.completed else 0.0,
+            }
+            for name, c in self.classes.items()
+        }
+
+
+admission = AdmissionController()
@@ -0,0 +1,495 @@
+# chunked_video.py
+"""
+Parallel long-video processing for /process_video.
+
+Chunk workers are separate processes with their own detector, so they do
+not take the server's PriorityLock: while a chunked job runs, its workers
+share the GPU with interactive requests instead of yielding it between
+batches. Admission still counts the job as one bulk slot; size
+CHUNK_WORKERS_PER_GPU with that in mind.
+"""
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tempfile import NamedTemporaryFile
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import ffmpeg
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "0"))  # Worker processes, each with its own detector; 0 = automatic
+CHUNK_WORKERS_PER_GPU = int(os.getenv("CHUNK_WORKERS_PER_GPU", "2"))  # Automatic size on GPU hosts; each worker holds a model in GPU memory
+CHUNK_MIN_FRAMES = int(os.getenv("CHUNK_MIN_FRAMES", "300"))  # Shorter chunks are not worth a worker
+CHUNK_OVERLAP_FRAMES = int(os.getenv("CHUNK_OVERLAP_FRAMES", "15"))  # Frames both neighbours track for stitching
+STITCH_MIN_SCORE = float(os.getenv("STITCH_MIN_SCORE", "0.3"))  # Minimum combined score to link two tracks
+STITCH_APPEARANCE_WEIGHT = float(os.getenv("STITCH_APPEARANCE_WEIGHT", "0.3"))  # Share of appearance in the score
+
+class EmptyVideoError(Exception):
+    """Raised when the input video has no frames to split."""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def gpu_count() -> int:
+    import torch
+    return torch.cuda.device_count() if torch.cuda.is_available() else 0
+
+
+def worker_count() -> int:
+    """
+    Size of the chunk pool: CHUNK_WORKERS when set, otherwise
+    CHUNK_WORKERS_PER_GPU per GPU, or one per CPU core without a GPU.
+    """
+    if CHUNK_WORKERS > 0:
+        return CHUNK_WORKERS
+    gpus = gpu_count()
+    return max(1, gpus * CHUNK_WORKERS_PER_GPU if gpus else (os.cpu_count() or 1))
+
+
+def _init_worker(counter, gpus: int, threads: int):
+    """
+    Pin each worker to one GPU, round-robin, before it initializes CUDA.
+    Without a GPU the cores are split between the workers instead of
+    every worker's torch using all of them.
+    """
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if gpus:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(index % gpus)
+    else:
+        import torch
+        torch.set_num_threads(threads)
+        cv2.setNumThreads(threads)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    Shared worker pool. Workers are spawned (CUDA cannot be forked) and each
+    loads its own detector on first use, then keeps it for later chunks.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            gpus = gpu_count()
+            workers = worker_count()
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(context.Value("i", 0), gpus, threads)
+            )
+            logger.info(f"✂️ Chunk worker pool: {workers} workers on {gpus or 'no'} GPUs")
+        return _pool
+
+
+# ── planning ──
+
+def count_frames(path: str) -> int:
+    """
+    Frame count from the container's packets (demuxed, not decoded); 0 when
+    it cannot be read. More reliable than CAP_PROP_FRAME_COUNT, which is
+    only an estimate from the header and is 0 for some streams.
+    """
+    try:
+        info = ffmpeg.probe(
+            path,
+            select_streams="v:0",
+            count_packets=None,
+            show_entries="stream=nb_read_packets"
+        )
+        return int(info["streams"][0]["nb_read_packets"])
+    except Exception as e:
+        logger.warning(f"Could not count frames: {e}")
+        return 0
+
+
+def keyframe_indices(path: str, fps: float) -> List[int]:
+    """Frame indices of the video's keyframes (only keyframes are decoded)."""
+    try:
+        info = ffmpeg.probe(
+            path,
+            select_streams="v:0",
+            skip_frame="nokey",
+            show_frames=None,
+            show_entries="frame=best_effort_timestamp_time"
+        )
+    except Exception as e:
+        logger.warning(f"Could not probe keyframes, splitting evenly: {e}")
+        return []
+    indices = set()
+    for frame in info.get("frames", []):
+        t = frame.get("best_effort_timestamp_time")
+        if t not in (None, "N/A"):
+            indices.add(int(round(float(t) * fps)))
+    return sorted(indices)
+
+
+def plan_chunks(total_frames: int, chunks: int, keyframes: List[int]) -> List[Tuple[int, int]]:
+    """
+    Split [0, total_frames) into up to `chunks` ranges whose starts are moved
+    to the nearest keyframe, so every worker can seek without decoding from
+    the previous GOP. An empty video gives an empty plan.
+    """
+    if total_frames <= 0:
+        return []
+    chunks = max(1, min(chunks, total_frames // max(CHUNK_MIN_FRAMES, 1)))
+    starts = {0}
+    for i in range(1, chunks):
+        target = i * total_frames // chunks
+        if keyframes:
+            target = min(keyframes, key=lambda k: abs(k - target))
+        if CHUNK_OVERLAP_FRAMES < target < total_frames:
+            starts.add(target)
+    starts = sorted(starts)
+    ends = starts[1:] + [total_frames]
+    return [(s, e) for s, e in zip(starts, ends) if e > s]
+
+
+# ── worker side ──
+
+def _resize_for_detection(frame: np.ndarray, max_width: int, max_height: int) -> np.ndarray:
+    height, width = frame.shape[:2]
+    if width <= max_width and height <= max_height:
+        return frame
+    scale = min(max_width / width, max_height / height)
+    return cv2.resize(frame, (int(width * scale), int(height * scale)))
+
+
+def track_chunk(
+    path: str,
+    index: int,
+    start: int,
+    end: int,
+    max_width: int,
+    max_height: int,
+    skip_frames: int = 0,
+    motion_gate: bool = True,
+    motion_threshold: float = None
+) -> dict:
+    """
+    Worker entry point: detect and track frames [start - overlap, end) with
+    this process's own detector and tracker. The leading overlap only warms
+    the tracker up and is used for stitching; boxes are normalized to [0,1].
+    skip_frames and the motion gate reuse detections as on the
+    single-process path.
+    """
+    # Imported here so only worker processes load the model
+    from app.detector import detect_objects
+    from app.deepsort_tracker import track_objects, TrackingSession
+    from app.motion_gate import MotionGate
+
+    warmup_start = max(0, start - CHUNK_OVERLAP_FRAMES) if index > 0 else start
+    tail_start = max(start, end - CHUNK_OVERLAP_FRAMES)
+    session = TrackingSession()
+    gate = MotionGate(enabled=motion_gate)
+    if motion_threshold is not None:
+        gate.threshold = motion_threshold
+    frames: Dict[int, list] = {}
+    head_features: Dict[int, list] = {}
+    tail_features: Dict[int, list] = {}
+
+    cap = cv2.VideoCapture(path)
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+        for frame_i in range(warmup_start, end):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            detection_img = _resize_for_detection(frame, max_width, max_height)
+            dets = gate.reuse(detection_img, skip=skip_frames)
+            if dets is None:
+                dets, _ = detect_objects(detection_img)
+                gate.commit(dets)
+            track_results = track_objects(dets, detection_img, return_raw_detections=True, session=session)
+
+            h, w = detection_img.shape[:2]
+            frames[frame_i] = [
+                [x1 / w, y1 / h, x2 / w, y2 / h, int(tid)]
+                for x1, y1, x2, y2, tid, _ in track_results
+            ]
+
+            # Appearance features of tracks seen in the overlap windows
+            target = head_features if frame_i < start else tail_features if frame_i >= tail_start else None
+            if target is not None:
+                for trk in session.tracker.tracker.tracks:
+                    feature = trk.get_feature() if hasattr(trk, "get_feature") else None
+                    if trk.is_confirmed() and feature is not None:
+                        target.setdefault(int(trk.track_id), []).append(np.asarray(feature, dtype=np.float32))
+    finally:
+        cap.release()
+
+    def mean_features(features):
+        out = {}
+        for tid, feats in features.items():
+            mean = np.mean(feats, axis=0)
+            norm = np.linalg.norm(mean)
+            out[tid] = (mean / norm).tolist() if norm > 0 else None
+        return out
+
+    return {
+        "index": index,
+        "start": start,
+        "end": end,
+        "warmup_start": warmup_start,
+        "frames": frames,
+        "head_features": mean_features(head_features),
+        "tail_features": mean_features(tail_features),
+    }
+
+
+def render_segment(
+    path: str,
+    start: int,
+    end: int,
+    boxes: Dict[int, list],
+    out_path: str,
+    fps: float,
+    size: Tuple[int, int],
+    encoder_options: dict
+) -> int:
+    """
+    Worker entry point: decode [start, end), draw stitched boxes and encode
+    a segment of the given size (frames are downscaled to it if needed).
+    """
+    from app.video_encoder import create_video_writer
+
+    width, height = size
+    writer = create_video_writer(out_path, fps, size, **encoder_options)
+    cap = cv2.VideoCapture(path)
+    written = 0
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        for frame_i in range(start, end):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame.shape[1] != width or frame.shape[0] != height:
+                frame = cv2.resize(frame, (width, height))
+            for x1, y1, x2, y2, track_id in boxes.get(frame_i, []):
+                x1, y1 = int(x1 * width), int(y1 * height)
+                x2, y2 = int(x2 * width), int(y2 * height)
+                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                cv2.putText(frame, f"person {track_id}", (x1, y1 - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+            writer.write(frame)
+            written += 1
+    finally:
+        cap.release()
+        writer.release()
+    return written
+
+
+# ── stitching ──
+
+def _iou(a, b) -> float:
+    xi1, yi1 = max(a[0], b[0]), max(a[1], b[1])
+    xi2, yi2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, xi2 - xi1) * max(0.0, yi2 - yi1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def link_tracks(prev: dict, cur: dict, prev_ids: Dict[int, int]) -> Dict[int, int]:
+    """
+    Match the current chunk's local track ids to the previous chunk's global
+    ids using the overlapping frames both processed: mean IoU over the
+    overlap, blended with cosine similarity of the tracks' appearance
+    features. Greedy assignment, best score first.
+    """
+    overlap = range(cur["warmup_start"], cur["start"])
+    if len(overlap) == 0:
+        return {}
+    iou_sum: Dict[Tuple[int, int], float] = {}
+    for frame_i in overlap:
+        for pb in prev["frames"].get(frame_i, []):
+            for cb in cur["frames"].get(frame_i, []):
+                iou = _iou(pb, cb)
+                if iou > 0:
+                    key = (pb[4], cb[4])
+                    iou_sum[key] = iou_sum.get(key, 0.0) + iou
+
+    scores = []
+    for (pid, cid), total in iou_sum.items():
+        score = total / len(overlap)
+        pf, cf = prev["tail_features"].get(pid), cur["head_features"].get(cid)
+        if pf is not None and cf is not None:
+            similarity = float(np.dot(pf, cf))
+            score = (1 - STITCH_APPEARANCE_WEIGHT) * score + STITCH_APPEARANCE_WEIGHT * similarity
+        if score >= STITCH_MIN_SCORE:
+            scores.append((score, pid, cid))
+
+    links = {}
+    used_prev = set()
+    for score, pid, cid in sorted(scores, reverse=True):
+        if pid in used_prev or cid in links or pid not in prev_ids:
+            continue
+        links[cid] = prev_ids[pid]
+        used_prev.add(pid)
+    return links
+
+
+def stitch(results: List[dict]) -> Tuple[Dict[int, list], int]:
+    """
+    Relabel every chunk's local ids to global ids and merge the per-frame
+    boxes of each chunk's output range. Returns (boxes by frame, unique ids).
+    """
+    boxes: Dict[int, list] = {}
+    next_id = 1
+    prev, prev_ids = None, {}
+    for chunk in results:
+        links = link_tracks(prev, chunk, prev_ids) if prev is not None else {}
+        local_ids = {b[4] for frame in chunk["frames"].values() for b in frame}
+        ids = {}
+        for local_id in sorted(local_ids):
+            if local_id in links:
+                ids[local_id] = links[local_id]
+            else:
+                ids[local_id] = next_id
+                next_id += 1
+        for frame_i in range(chunk["start"], chunk["end"]):
+            boxes[frame_i] = [b[:4] + [ids[b[4]]] for b in chunk["frames"].get(frame_i, [])]
+        logger.info(f"🧵 Chunk {chunk['index']}: linked {len(links)} of {len(local_ids)} tracks to the previous chunk")
+        prev, prev_ids = chunk, ids
+    return boxes, next_id - 1
+
+
+# ── driver ──
+
+def concat_segments(segments: List[str], out_path: str):
+    """Concatenate encoded segments without re-encoding."""
+    with NamedTemporaryFile("w", suffix=".txt", delete=False) as list_file:
+        for segment in segments:
+            list_file.write(f"file '{segment}'\n")
+    try:
+        (
+            ffmpeg
+            .input(list_file.name, format="concat", safe=0)
+            .output(out_path, c="copy", movflags="+faststart")
+            .overwrite_output()
+            .run(quiet=True)
+        )
+    finally:
+        os.remove(list_file.name)
+
+
+def process_video_chunked(
+    path: str,
+    out_path: str,
+    chunks: int,
+    max_width: int,
+    max_height: int,
+    encoder_options: dict,
+    output_size: Tuple[int, int] = None,
+    skip_frames: int = 0,
+    motion_gate: bool = True,
+    motion_threshold: float = None,
+    on_progress: Optional[Callable[[dict], None]] = None
+) -> dict:
+    """
+    Process a long video as parallel keyframe-aligned chunks: track each
+    chunk in a worker process, stitch track ids across boundaries, then
+    render and encode the segments in parallel and concatenate them.
+    output_size defaults to the input size. on_progress is called from this
+    thread with a progress message whenever a chunk is tracked or rendered.
+    Raises EmptyVideoError for a video without frames. Blocking; run it in
+    an executor.
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError("❌ Failed to open input video")
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    # The header count is an estimate; chunk ends must be real frames
+    total_frames = count_frames(path) or total_frames
+    output_size = output_size or (width, height)
+
+    start_time = time.time()
+    plan = plan_chunks(total_frames, chunks, keyframe_indices(path, fps))
+    if not plan:
+        raise EmptyVideoError("Input video has no frames")
+    logger.info(f"✂️ Processing {total_frames} frames as {len(plan)} chunks: {plan}")
+
+    # Every chunk is tracked and rendered; concatenation is the last step
+    steps = 2 * len(plan) + 1
+    done = 0
+
+    def report(stage: str):
+        nonlocal done
+        done += 1
+        if on_progress is not None:
+            elapsed = time.time() - start_time
+            on_progress({
+                "type": "progress",
+                "progress": done / steps,
+                "stage": stage,
+                "chunks": len(plan),
+                "total_frames": total_frames,
+                "elapsed_time": f"{elapsed:.1f}s",
+                "remaining_time": f"{elapsed * (steps - done) / done:.1f}s"
+            })
+
+    pool = get_pool()
+    futures = [
+        pool.submit(
+            track_chunk, path, i, start, end, max_width, max_height,
+            skip_frames, motion_gate, motion_threshold
+        )
+        for i, (start, end) in enumerate(plan)
+    ]
+    results = []
+    for future in as_completed(futures):
+        results.append(future.result())
+        report("tracking")
+    results.sort(key=lambda r: r["index"])
+    boxes, unique_tracks = stitch(results)
+    tracking_time = time.time() - start_time
+
+    segments = []
+    try:
+        for _ in plan:
+            segment = NamedTemporaryFile(suffix=".mp4", delete=False)
+            segment.close()
+            segments.append(segment.name)
+        futures = [
+            pool.submit(
+                render_segment, path, start, end,
+                {i: boxes.get(i, []) for i in range(start, end)},
+                segment, fps, output_size, encoder_options
+            )
+            for (start, end), segment in zip(plan, segments)
+        ]
+        written = 0
+        for future in as_completed(futures):
+            written += future.result()
+            report("rendering")
+        concat_segments(segments, out_path)
+    finally:
+        for segment in segments:
+            try:
+                os.remove(segment)
+            except OSError:
+                pass
+
+    return {
+        "total_frames": total_frames,
+        "processed_frames": written,
+        "chunks": len(plan),
+        "unique_tracks": unique_tracks,
+        "tracking_time": tracking_time,
+        "processing_time": time.time() - start_time,
+    }
@@ -12,27 +12,92 @@ MAX_AGE = int(os.getenv("MAX_AGE", "30"))  # Maximum frames to keep track
 NMS_MAX_OVERLAP = float(os.getenv("NMS_MAX_OVERLAP", "0.8"))  # NMS threshold
 MAX_COSINE_DISTANCE = float(os.getenv("MAX_COSINE_DISTANCE", "0.25"))  # Feature similarity threshold
 NN_BUDGET = int(os.getenv("NN_BUDGET", "150"))  # Maximum size of feature database
+EMBED_DIM = int(os.getenv("EMBED_DIM", "1280"))  # Feature size of the mobilenet embedder
 
 # Initialize DeepSORT tracker with optimized settings for person tracking
-def create_tracker():
-    return DeepSort(
+def create_tracker(embedder=None):
+    """
+    Create a DeepSORT tracker. Passing an already-loaded embedder shares it
+    instead of loading another copy of the mobilenet weights.
+    """
+    ds = DeepSort(
         max_age=MAX_AGE,
         n_init=1,                  # Reduced to 1 for immediate track confirmation
         nms_max_overlap=NMS_MAX_OVERLAP,
         max_cosine_distance=MAX_COSINE_DISTANCE,
         nn_budget=NN_BUDGET,
         override_track_class=None,
-        embedder="mobilenet",      # Lightweight embedder for speed
+        embedder="mobilenet" if embedder is None else None,  # Lightweight embedder for speed
         half=True,                 # FP16 for faster inference
         bgr=True,
         embedder_gpu=True          # Use GPU for embeddings
     )
+    if embedder is not None:
+        ds.embedder = embedder
+    return ds
 
 # original global for backwards-compatibility
 tracker = create_tracker()
 
-# Box smoothing parameters
-smoothers = {}  # track_id → [x1,y1,x2,y2]
+# Minimum distance (px) between a raw fallback detection and an existing result
+FALLBACK_MIN_DISTANCE = 20
+
+
+class TrackStore:
+    """
+    Compact per-track state kept between frames: track ids, EMA-smoothed
+    boxes and the number of consecutive frames each id has been reported.
+    Rows are parallel NumPy arrays so lookups and smoothing are vectorized.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def clear(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.int64)  # smoothed [l, t, r, b]
+        self.ages = np.empty(0, dtype=np.int64)
+
+    def lookup(self, ids: np.ndarray):
+        """Return (found mask, row index) of ids in the store."""
+        if len(self.ids) == 0 or len(ids) == 0:
+            return np.zeros(len(ids), dtype=bool), np.zeros(len(ids), dtype=np.int64)
+        order = np.argsort(self.ids)
+        pos = np.searchsorted(self.ids[order], ids)
+        pos = np.minimum(pos, len(order) - 1)
+        rows = order[pos]
+        return self.ids[rows] == ids, rows
+
+    def smooth(self, ids: np.ndarray, raw: np.ndarray) -> np.ndarray:
+        """Apply exponential moving average smoothing against the stored boxes."""
+        out = raw.copy()
+        found, rows = self.lookup(ids)
+        if found.any():
+            prev = self.boxes[rows[found]]
+            out[found] = np.trunc(SMOOTH_ALPHA * raw[found] + (1 - SMOOTH_ALPHA) * prev).astype(np.int64)
+        return out
+
+    def replace(self, ids: np.ndarray, boxes: np.ndarray, keep_ids=()):
+        """
+        Keep state only for the given ids; ages carry over for known ids.
+        Existing rows whose id is in keep_ids (ids handed out to raw fallback
+        detections this frame) are left untouched.
+        """
+        found, rows = self.lookup(ids)
+        ages = np.ones(len(ids), dtype=np.int64)
+        ages[found] += self.ages[rows[found]]
+
+        kept = np.isin(self.ids, np.asarray(keep_ids, dtype=np.int64)) & ~np.isin(self.ids, ids)
+        self.ids = np.concatenate([ids.astype(np.int64), self.ids[kept]])
+        self.boxes = np.concatenate([boxes.astype(np.int64).reshape(-1, 4), self.boxes[kept]])
+        self.ages = np.concatenate([ages, self.ages[kept]])
+
+
+track_store = TrackStore()
+
 
 def _warmup_tracker():
     """Warm up the tracker's embedder to reduce first-frame lag"""
@@ -47,17 +112,45 @@ _warmup_tracker()
 def reset_tracks():
     """Reset all tracks in the tracker and clear smoothing history."""
     global tracker
-    tracker = create_tracker()
-    smoothers.clear()  # Clear EMA history
+    tracker = create_tracker(embedder=tracker.embedder)
+    track_store.clear()  # Clear EMA history
 
 tracker.reset_tracks = reset_tracks
 
-def smooth_box(raw_box, prev_box):
-    """Apply exponential moving average smoothing to bounding box"""
-    if prev_box is None:
-        return raw_box
-    return [int(SMOOTH_ALPHA * r + (1 - SMOOTH_ALPHA) * p) 
-            for r, p in zip(raw_box, prev_box)]
+
+class TrackingSession:
+    """
+    Independent tracker and EMA state for one stream (e.g. one video job),
+    so concurrent streams do not share track ids or smoothing history.
+    The embedder of the global tracker is shared.
+    """
+
+    def __init__(self):
+        self.tracker = create_tracker(embedder=tracker.embedder)
+        self.store = TrackStore()
+
+    def reset(self):
+        self.tracker = create_tracker(embedder=self.tracker.embedder)
+        self.store.clear()
+
+
+def predict_track_box(track_id: int, session: TrackingSession = None):
+    """
+    Predict where a confirmed track will be on the next frame from its
+    Kalman state ([cx, cy, aspect, h] plus velocities). Returns [l, t, r, b]
+    or None if the track is unknown.
+    """
+    deepsort = session.tracker if session is not None else tracker
+    for trk in deepsort.tracker.tracks:
+        if int(trk.track_id) != track_id or not trk.is_confirmed():
+            continue
+        if trk.mean is None:
+            return list(trk.to_ltrb())
+        cx, cy, a, h, vx, vy, va, vh = trk.mean[:8]
+        cx, cy, a, h = cx + vx, cy + vy, a + va, max(h + vh, 1.0)
+        w = max(a * h, 1.0)
+        return [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2]
+    return None
 
 def is_valid_bbox(bbox: list, image: np.ndarray = None) -> bool:
     """
@@ -91,95 +184,148 @@ def is_valid_bbox(bbox: list, image: np.ndarray = None) -> bool:
     
     return True
 
+def valid_bbox_mask(boxes: np.ndarray, image: np.ndarray = None) -> np.ndarray:
+    """
+    Vectorized is_valid_bbox() over an (N, 4) array of [l, t, r, b] boxes.
+    """
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    width = boxes[:, 2] - boxes[:, 0]
+    height = boxes[:, 3] - boxes[:, 1]
+
+    mask = (width > 0) & (height > 0)
+    mask &= (width >= 10) & (height >= 20)
+    aspect_ratio = np.divide(height, width, out=np.zeros_like(height), where=width > 0)
+    mask &= (aspect_ratio >= 1.0) & (aspect_ratio <= 3.0)
+
+    if image is not None:
+        h, w = image.shape[:2]
+        mask &= (width <= 0.8 * w) & (height <= 0.8 * h)
+    return mask
+
+def constant_embeds(count: int) -> np.ndarray:
+    """
+    Placeholder features for embedder-free updates; DeepSORT requires one
+    per detection but they are never compared (see AppearanceFreeMetric).
+    """
+    return np.full((count, EMBED_DIM), 1.0 / np.sqrt(EMBED_DIM), dtype=np.float32)
+
+class AppearanceFreeMetric:
+    """
+    Stand-in for DeepSORT's cosine metric during embedder-free updates.
+    Every appearance cost is infinite, so the matching cascade matches
+    nothing and detections are associated by the IoU stage alone (SORT).
+    The placeholder features are not added to the track galleries.
+    """
+
+    def __init__(self, metric):
+        self.matching_threshold = metric.matching_threshold
+
+    def distance(self, features, targets):
+        return np.full((len(targets), len(features)), np.inf)
+
+    def partial_fit(self, features, targets, active_targets):
+        pass
+
 def track_objects(
     detections: np.ndarray,
     image: np.ndarray,
     focus_id: int = None,
-    return_raw_detections: bool = False
+    return_raw_detections: bool = False,
+    use_embedder: bool = True,
+    session: TrackingSession = None
 ) -> list:
     """
     Enhanced tracking with better filtering and motion prediction.
+    use_embedder=False skips appearance features and associates by IoU only
+    (cheaper, used under load).
+    Without a session the global tracker and smoothing state are used.
     """
+    deepsort = session.tracker if session is not None else tracker
+    store = session.store if session is not None else track_store
+
     # Even if there are no new detections, let DeepSORT predict motion
-    if detections is None:
+    if detections is None or len(detections) == 0:
         detections = np.empty((0, 6))
     
     # Get original image dimensions for possible rescaling later
     img_height, img_width = image.shape[:2]
     
     # Keep only person detections and valid-size boxes
-    person_detections = detections[detections[:, 5] == 0] if len(detections) > 0 else detections
-    filtered = []
-    
-    for det in person_detections:
-        bbox = det[:4].tolist()
-        if is_valid_bbox(bbox, image):
-            filtered.append(det)
-
-    # Convert to DeepSORT input format with confidence scores
-    detection_list = []
-    if filtered:
-        for x1, y1, x2, y2, conf, cls in filtered:
-            # compute width and height for DeepSORT input
-            w = x2 - x1
-            h = y2 - y1
-            detection_list.append(([x1, y1, w, h], float(conf), 'person'))  # Use XYWH for DeepSORT
+    detections = np.asarray(detections, dtype=float)
+    filtered = detections[(detections[:, 5] == 0) & valid_bbox_mask(detections[:, :4], image)]
+
+    # Convert to DeepSORT input format (XYWH) with confidence scores
+    xywh = filtered[:, :4].copy()
+    xywh[:, 2:] -= filtered[:, :2]
+    detection_list = [
+        (box, conf, 'person')
+        for box, conf in zip(xywh.tolist(), filtered[:, 4].tolist())
+    ]
 
     # Update tracker with motion prediction
-    tracks = tracker.update_tracks(detection_list, frame=image)
+    if use_embedder:
+        tracks = deepsort.update_tracks(detection_list, frame=image)
+    else:
+        metric = deepsort.tracker.metric
+        deepsort.tracker.metric = AppearanceFreeMetric(metric)
+        try:
+            tracks = deepsort.update_tracks(detection_list, embeds=constant_embeds(len(detection_list)), frame=image)
+        finally:
+            deepsort.tracker.metric = metric
 
-    results = []
-    confirmed_ids = set()
-    
-    # Process confirmed tracks first
-    for trk in tracks:
-        if not trk.is_confirmed():
-            continue
-            
-        tid = int(trk.track_id)
-        confirmed_ids.add(tid)
-        
-        if focus_id is not None and tid != focus_id:
-            continue
-            
-        raw = list(map(int, trk.to_ltrb()))
-        
-        # Apply exponential moving average smoothing
-        sm = smooth_box(raw, smoothers.get(tid))
-        smoothers[tid] = sm
-        
-        l, t, r, b = sm
-        
-        # Ensure coordinates are within image boundaries
-        l = max(0, min(l, img_width - 1))
-        t = max(0, min(t, img_height - 1))
-        r = max(l + 1, min(r, img_width))
-        b = max(t + 1, min(b, img_height))
-        
-        # Additional validation on track box
-        if is_valid_bbox([l, t, r, b], image):
-            results.append([l, t, r, b, tid, 0])
+    confirmed = [trk for trk in tracks if trk.is_confirmed()]
+    confirmed_ids = np.array([int(trk.track_id) for trk in confirmed], dtype=np.int64)
+    focused = [
+        trk for trk, tid in zip(confirmed, confirmed_ids)
+        if focus_id is None or tid == focus_id
+    ]
+    ids = np.array([int(trk.track_id) for trk in focused], dtype=np.int64)
+    raw = np.trunc(np.array([trk.to_ltrb() for trk in focused], dtype=float).reshape(-1, 4)).astype(np.int64)
+
+    # Apply exponential moving average smoothing
+    sm = store.smooth(ids, raw)
+
+    # Ensure coordinates are within image boundaries
+    boxes = sm.copy()
+    boxes[:, 0] = np.clip(boxes[:, 0], 0, img_width - 1)
+    boxes[:, 1] = np.clip(boxes[:, 1], 0, img_height - 1)
+    boxes[:, 2] = np.maximum(boxes[:, 0] + 1, np.minimum(boxes[:, 2], img_width))
+    boxes[:, 3] = np.maximum(boxes[:, 1] + 1, np.minimum(boxes[:, 3], img_height))
+
+    # Additional validation on track box
+    valid = valid_bbox_mask(boxes, image)
+    boxes, ids = boxes[valid], ids[valid]
+
+    results = [[l, t, r, b, tid, 0] for (l, t, r, b), tid in zip(boxes.tolist(), ids.tolist())]
+    fallback_ids = []
 
     # Add raw detections as fallback if requested
     if return_raw_detections and len(results) < len(filtered):
-        next_id = max(confirmed_ids, default=0) + 1
-        for det in filtered:
-            x1, y1, x2, y2 = det[:4]
-            
-            # Skip if too close to existing track
-            if any(abs(x1 - l) < 20 and abs(y1 - t) < 20 for l, t, *_ in results):
+        next_id = int(confirmed_ids.max()) + 1 if len(confirmed_ids) else 1
+        corners = filtered[:, :2]
+
+        # Skip detections too close to an existing track
+        near_track = (
+            np.abs(corners[:, None, :] - boxes[None, :, :2]) < FALLBACK_MIN_DISTANCE
+        ).all(axis=2).any(axis=1)
+        candidates = filtered[~near_track]
+
+        # ...or to a fallback accepted earlier in this frame
+        near_each_other = (
+            np.abs(candidates[:, None, :2] - candidates[None, :, :2]) < FALLBACK_MIN_DISTANCE
+        ).all(axis=2)
+        suppressed = np.zeros(len(candidates), dtype=bool)
+        for i in range(len(candidates)):
+            if suppressed[i]:
                 continue
-                
-            # Validate raw detection box
-            if is_valid_bbox([x1, y1, x2, y2], image):
-                results.append([x1, y1, x2, y2, next_id, 0])
-                next_id += 1
-
-    # Cleanup old tracks from smoothers
-    active_ids = {r[4] for r in results}
-    smoothers_to_remove = [tid for tid in smoothers if tid not in active_ids]
-    for tid in smoothers_to_remove:
-        del smoothers[tid]
+            suppressed |= near_each_other[i]
+            x1, y1, x2, y2 = candidates[i, :4].tolist()
+            results.append([x1, y1, x2, y2, next_id, 0])
+            fallback_ids.append(next_id)
+            next_id += 1
+
+    # Only reported ids keep EMA state
+    store.replace(ids, sm[valid], keep_ids=fallback_ids)
 
     # Cleanup
     del tracks
@@ -1,6 +1,5 @@
 # detector.py
 import os
-import cv2
 import numpy as np
 import torch
 import torch.backends.cudnn as cudnn
@@ -8,6 +7,7 @@ import gc
 import logging
 from ultralytics import YOLO
 from typing import List
+from app.admission import PriorityLock, INTERACTIVE, BULK
 
 logger = logging.getLogger(__name__)
 # Enable cuDNN autotuner for fastest GPU convolution kernels
@@ -18,6 +18,20 @@ model_path = os.path.join(os.path.dirname(__file__), "best.pt")
 if not os.path.exists(model_path):
     raise FileNotFoundError(f"Model not found at {model_path}")
 
+
+def weights_fingerprint(path: str = model_path) -> str:
+    """Identify a weights file by size and modification time."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+# Fingerprint of the weights actually loaded below (the file on disk may be
+# replaced later without the model being reloaded)
+loaded_fingerprint = weights_fingerprint()
+
 # Choose device
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 # Instantiate and prepare model
@@ -38,21 +52,32 @@ PERSON_CLASS_ID = 0
 CONF_THRESHOLD = float(os.getenv("YOLO_CONF_THRESHOLD", "0.40"))
 IOU_THRESHOLD = float(os.getenv("YOLO_IOU_THRESHOLD", "0.60"))
 
+# Ultralytics predictors are not thread-safe; inference from the request
+# thread and background workers is serialized on this lock, with
+# interactive callers served before bulk ones
+inference_lock = PriorityLock()
+
 
-def detect_objects(image: np.ndarray):
+def detect_objects(image: np.ndarray, raise_on_error: bool = False, imgsz: int = None, priority: int = INTERACTIVE):
     """
     Detect persons in a single image and return array of [x1,y1,x2,y2,conf,cls].
+    With raise_on_error the inference error is re-raised instead of being
+    reported as an empty detection set (callers that cache results need this).
+    imgsz overrides the model's letterbox input size (multiple of 32).
+    priority decides the turn on the model (INTERACTIVE or BULK).
     """
     if image is None:
         raise ValueError("Invalid image provided")
     try:
         # Inference (Ultralytics will automatically letterbox & send to GPU)
-        with torch.no_grad():
+        extra = {"imgsz": imgsz} if imgsz else {}
+        with inference_lock.hold(priority), torch.no_grad():
             results = model(
                 image,                # H×W×3 uint8 BGR or RGB
                 conf=CONF_THRESHOLD,  # confidence threshold
                 iou=IOU_THRESHOLD,    # IoU threshold
-                device=device         # 'cuda' or 'cpu'
+                device=device,        # 'cuda' or 'cpu'
+                **extra
             )
 
         # Parse detections
@@ -78,30 +103,33 @@ def detect_objects(image: np.ndarray):
 
     except Exception:
         logger.exception("Error during detect_objects")
+        if raise_on_error:
+            raise
         return np.empty((0,6), dtype=float), image
 
 
 
-def detect_objects_batch(images: List[np.ndarray]) -> List[np.ndarray]:
+def detect_objects_batch(
+    images: List[np.ndarray],
+    raise_on_error: bool = False,
+    imgsz: int = None,
+    priority: int = BULK
+) -> List[np.ndarray]:
     """
     Batch-detect persons in a list of images, returning list of detection arrays.
+    Images may differ in size; Ultralytics letterboxes each one exactly as
+    detect_objects() does, so results match the single-image path.
     """
     try:
-        # Preprocess all images
-        tensors = []
-        for img in images:
-            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            t = (
-                torch.from_numpy(rgb)
-                     .to(device, dtype=torch.float16)
-                     .permute(2, 0, 1)
-                     .unsqueeze(0)
-                     .div(255.0)
+        extra = {"imgsz": imgsz} if imgsz else {}
+        with inference_lock.hold(priority), torch.no_grad():
+            results = model(
+                list(images),         # list of H×W×3 uint8 BGR frames
+                conf=CONF_THRESHOLD,
+                iou=IOU_THRESHOLD,
+                device=device,
+                **extra
             )
-            tensors.append(t)
-        batch = torch.cat(tensors, dim=0)
-        with torch.no_grad():
-            results = model(batch, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD)
         outputs = []
         for res in results:
             frame_dets = []
@@ -112,14 +140,16 @@ def detect_objects_batch(images: List[np.ndarray]) -> List[np.ndarray]:
                 x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().tolist()
                 conf = float(box.conf[0].cpu().item())
                 frame_dets.append([x1, y1, x2, y2, conf, cls_id])
-            outputs.append(np.array(frame_dets) if frame_dets else np.empty((0,6)))
-        del results, batch
+            outputs.append(np.array(frame_dets, dtype=float) if frame_dets else np.empty((0,6), dtype=float))
+        del results
         gc.collect()
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
         return outputs
     except Exception:
         logger.exception("Error during detect_objects_batch")
+        if raise_on_error:
+            raise
         return [np.empty((0,6)) for _ in images]
 
 
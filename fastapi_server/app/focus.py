@@ -0,0 +1,190 @@
+# focus.py
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+from app.detector import detect_objects
+from app.deepsort_tracker import predict_track_box
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+FOCUS_ROI_EXPAND = float(os.getenv("FOCUS_ROI_EXPAND", "2.0"))  # Crop size relative to predicted box
+FOCUS_ROI_MIN_SIZE = int(os.getenv("FOCUS_ROI_MIN_SIZE", "96"))  # Minimum crop side in pixels
+FOCUS_ROI_IMGSZ = int(os.getenv("FOCUS_ROI_IMGSZ", "320"))  # Detector input size for crops
+FOCUS_REFRESH_INTERVAL = int(os.getenv("FOCUS_REFRESH_INTERVAL", "15"))  # Full-frame refresh every N frames
+FOCUS_HIT_IOU = float(os.getenv("FOCUS_HIT_IOU", "0.3"))  # Overlap with the predicted box that counts as finding the target
+FOCUS_MAX_STREAMS = int(os.getenv("FOCUS_MAX_STREAMS", "256"))  # Streams with their own focus state
+FOCUS_IDLE_S = float(os.getenv("FOCUS_IDLE_S", "300"))  # Focus state of idle streams is dropped
+
+
+def box_ious(box, dets: np.ndarray) -> np.ndarray:
+    """IoU of one [x1,y1,x2,y2] box against every detection row."""
+    l, t, r, b = box
+    iw = np.clip(np.minimum(dets[:, 2], r) - np.maximum(dets[:, 0], l), 0, None)
+    ih = np.clip(np.minimum(dets[:, 3], b) - np.maximum(dets[:, 1], t), 0, None)
+    inter = iw * ih
+    union = (r - l) * (b - t) + (dets[:, 2] - dets[:, 0]) * (dets[:, 3] - dets[:, 1]) - inter
+    return np.divide(inter, union, out=np.zeros_like(inter, dtype=float), where=union > 0)
+
+
+class FocusState:
+    """Focus target, refresh counter and metrics of one stream."""
+
+    COUNTERS = (
+        "frames", "crop_frames", "crop_hits", "full_frames",
+        "periodic_refreshes", "reacquire_attempts", "reacquired",
+    )
+
+    def __init__(self):
+        self.focus_id: Optional[int] = None
+        self.since_full = 0
+        self.reacquiring = False
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+
+
+class FocusController:
+    """
+    Region-of-interest inference for a focused track.
+
+    The focused track's next box is predicted from the tracker's Kalman state
+    and detection runs on an expanded crop around it at a smaller input size.
+    A full-frame pass is used when there is no prediction, every
+    FOCUS_REFRESH_INTERVAL frames, and whenever no detection in the crop
+    overlaps the predicted box (re-acquisition); a bystander inside the crop
+    does not keep the ROI alive.
+
+    State is kept per stream (the client's stream_id, or the focus id for
+    anonymous requests), so clients focusing on different tracks do not
+    force each other into full-frame refreshes. Least recently used and
+    idle streams are dropped, as for the motion gates.
+    """
+
+    def __init__(self, max_streams: int = FOCUS_MAX_STREAMS, idle_s: float = FOCUS_IDLE_S):
+        self.max_streams = max(1, max_streams)
+        self.idle_s = idle_s
+        self._lock = threading.Lock()
+        self._streams: "OrderedDict[str, Tuple[FocusState, float]]" = OrderedDict()
+        self._retired = dict.fromkeys(FocusState.COUNTERS, 0)  # metrics of dropped streams
+        self.evicted = 0
+
+    @staticmethod
+    def stream_key(stream_id: Optional[str], focus_id: int) -> str:
+        return f"stream:{stream_id}" if stream_id else f"focus:{focus_id}"
+
+    def _state(self, key: str) -> FocusState:
+        """State of a stream, marked as used now; called with the lock held."""
+        now = time.monotonic()
+        entry = self._streams.pop(key, None)
+        state = entry[0] if entry is not None else FocusState()
+        self._streams[key] = (state, now)
+        while self._streams:
+            oldest, (old_state, last_used) = next(iter(self._streams.items()))
+            if len(self._streams) <= self.max_streams and now - last_used < self.idle_s:
+                break
+            del self._streams[oldest]
+            for name in FocusState.COUNTERS:
+                self._retired[name] += getattr(old_state, name)
+            self.evicted += 1
+        return state
+
+    def roi(self, box, image_shape):
+        """Expand the predicted box into a crop window clipped to the image."""
+        img_h, img_w = image_shape[:2]
+        l, t, r, b = box
+        cx, cy = (l + r) / 2, (t + b) / 2
+        w = max((r - l) * FOCUS_ROI_EXPAND, FOCUS_ROI_MIN_SIZE)
+        h = max((b - t) * FOCUS_ROI_EXPAND, FOCUS_ROI_MIN_SIZE)
+        x0 = int(max(0, cx - w / 2))
+        y0 = int(max(0, cy - h / 2))
+        x1 = int(min(img_w, cx + w / 2))
+        y1 = int(min(img_h, cy + h / 2))
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None
+        return x0, y0, x1, y1
+
+    def detect(
+        self,
+        image: np.ndarray,
+        focus_id: int,
+        full_detect: Callable[[np.ndarray], np.ndarray],
+        stream_id: Optional[str] = None
+    ) -> np.ndarray:
+        """
+        Return full-frame detections for the focused request, running YOLO
+        only on the focus crop when possible. full_detect runs a full-frame pass.
+        """
+        with self._lock:
+            state = self._state(self.stream_key(stream_id, focus_id))
+            state.frames += 1
+            new_target = focus_id != state.focus_id
+            if new_target:
+                state.focus_id = focus_id
+                state.reacquiring = False
+            refresh_due = new_target or state.since_full >= FOCUS_REFRESH_INTERVAL
+
+        box = None if refresh_due else predict_track_box(focus_id)
+        window = self.roi(box, image.shape) if box is not None else None
+
+        if window is not None:
+            x0, y0, x1, y1 = window
+            dets, _ = detect_objects(image[y0:y1, x0:x1], imgsz=FOCUS_ROI_IMGSZ)
+            if len(dets):
+                dets = dets.copy()
+                dets[:, [0, 2]] += x0
+                dets[:, [1, 3]] += y0
+            hit = len(dets) > 0 and box_ious(box, dets).max() >= FOCUS_HIT_IOU
+            with self._lock:
+                state.crop_frames += 1
+                if hit:
+                    state.crop_hits += 1
+                    state.since_full += 1
+                else:
+                    # Lost the target inside the crop: fall back to a full frame
+                    state.reacquire_attempts += 1
+                    state.reacquiring = True
+            if hit:
+                return dets
+
+        dets = full_detect(image)
+        with self._lock:
+            state.full_frames += 1
+            if refresh_due and not new_target:
+                state.periodic_refreshes += 1
+            state.since_full = 0
+        return dets
+
+    def record_result(self, focus_id: int, track_results: list, stream_id: Optional[str] = None):
+        """Count a re-acquisition once the focused id shows up again after a miss."""
+        with self._lock:
+            entry = self._streams.get(self.stream_key(stream_id, focus_id))
+            if entry is None or not entry[0].reacquiring:
+                return
+            state = entry[0]
+            if any(int(r[4]) == focus_id for r in track_results):
+                state.reacquired += 1
+            state.reacquiring = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = [state for state, _ in self._streams.values()]
+            totals = {
+                name: self._retired[name] + sum(getattr(state, name) for state in states)
+                for name in FocusState.COUNTERS
+            }
+            return {
+                "streams": len(states),
+                "evicted_streams": self.evicted,
+                "focus_ids": sorted({state.focus_id for state in states if state.focus_id is not None}),
+                **totals,
+                "crop_hit_rate": totals["crop_hits"] / totals["crop_frames"] if totals["crop_frames"] else 0.0,
+            }
+
+
+focus_controller = FocusController()
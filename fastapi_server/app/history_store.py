@@ -0,0 +1,352 @@
+# history_store.py
+import os
+import re
+import json
+import time
+import queue
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history")  # Empty string disables the history store
+HISTORY_FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS", "4096"))  # Rows buffered per session before a write
+HISTORY_FLUSH_INTERVAL_S = float(os.getenv("HISTORY_FLUSH_INTERVAL_S", "1.0"))  # Maximum age of buffered rows
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "1024"))  # Pending appends before new ones are dropped
+HISTORY_QUERY_LIMIT = int(os.getenv("HISTORY_QUERY_LIMIT", "10000"))  # Maximum rows returned by one query
+
+# Fixed-width columns, one file each
+COLUMNS = {
+    "timestamp": np.dtype("<f8"),
+    "track_id": np.dtype("<i4"),
+    "x1": np.dtype("<f4"),
+    "y1": np.dtype("<f4"),
+    "x2": np.dtype("<f4"),
+    "y2": np.dtype("<f4"),
+    "confidence": np.dtype("<f4"),
+}
+
+INDEX_FILE = "index.json"
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def is_valid_session_id(session_id: str) -> bool:
+    return bool(SESSION_ID_PATTERN.match(session_id or ""))
+
+
+def validate_session_id(session_id: str) -> str:
+    if not is_valid_session_id(session_id):
+        raise ValueError("session_id must be 1-64 characters of letters, digits, '_' or '-'")
+    return session_id
+
+
+class _SessionIndex:
+    """
+    Row count, time bounds and per-track row spans of one session. Rows are
+    appended in time order, so time ranges are found with searchsorted();
+    a session that ever receives an older timestamp is marked unsorted and
+    falls back to a masked scan.
+    """
+
+    def __init__(self, data: Optional[dict] = None):
+        data = data or {}
+        self.rows = data.get("rows", 0)
+        self.sorted = data.get("sorted", True)
+        self.first_ts = data.get("first_ts")
+        self.last_ts = data.get("last_ts")
+        # track_id -> [first_row, last_row, count, first_ts, last_ts]
+        self.tracks: Dict[int, list] = {int(k): list(v) for k, v in data.get("tracks", {}).items()}
+
+    def update(self, columns: Dict[str, np.ndarray]):
+        ts = columns["timestamp"]
+        if len(ts) == 0:
+            return
+        if (self.last_ts is not None and ts[0] < self.last_ts) or np.any(np.diff(ts) < 0):
+            self.sorted = False
+        rows = np.arange(self.rows, self.rows + len(ts))
+        ids, first = np.unique(columns["track_id"], return_index=True)
+        for track_id, i in zip(ids.tolist(), first.tolist()):
+            mask = columns["track_id"] == track_id
+            last = rows[mask][-1]
+            t_first, t_last = float(ts[mask].min()), float(ts[mask].max())
+            entry = self.tracks.get(track_id)
+            if entry is None:
+                self.tracks[track_id] = [int(rows[i]), int(last), int(mask.sum()), t_first, t_last]
+            else:
+                entry[1] = int(last)
+                entry[2] += int(mask.sum())
+                entry[3] = min(entry[3], t_first)
+                entry[4] = max(entry[4], t_last)
+        self.first_ts = float(ts.min()) if self.first_ts is None else min(self.first_ts, float(ts.min()))
+        self.last_ts = float(ts.max()) if self.last_ts is None else max(self.last_ts, float(ts.max()))
+        self.rows += len(ts)
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "sorted": self.sorted,
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+            "tracks": {str(k): v for k, v in self.tracks.items()},
+        }
+
+
+class HistoryStore:
+    """
+    Append-only, per-session track history.
+
+    Every session is a directory of fixed-width column files plus a small
+    JSON index. Appends only enqueue arrays; a background thread buffers
+    them per session and writes whole batches, so request handlers never
+    touch the disk. Reads memory-map the columns and slice them by the
+    index, so queries only page in the rows they return.
+    """
+
+    def __init__(self, root: str = HISTORY_DIR, flush_rows: int = HISTORY_FLUSH_ROWS,
+                 flush_interval: float = HISTORY_FLUSH_INTERVAL_S, queue_size: int = HISTORY_QUEUE_SIZE):
+        self.root = root or None
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._indexes: Dict[str, _SessionIndex] = {}
+        self._latest: Dict[str, float] = {}  # newest timestamp appended per session
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self.rows_written = 0
+        self.batches_written = 0
+        self.dropped = 0
+        self.write_time = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None
+
+    def _session_dir(self, session_id: str) -> str:
+        return os.path.join(self.root, validate_session_id(session_id))
+
+    def append(self, session_id: str, timestamp, track_ids, boxes, confidences):
+        """
+        Queue track records for a session. ``timestamp`` is a scalar or one
+        value per row, ``boxes`` an (N, 4) array of normalized x1, y1, x2, y2.
+        Never blocks: when the writer falls behind, the records are dropped
+        and counted.
+        """
+        if not self.enabled or not session_id:
+            return
+        validate_session_id(session_id)
+        track_ids = np.asarray(track_ids, dtype=COLUMNS["track_id"]).reshape(-1)
+        if len(track_ids) == 0:
+            return
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        columns = {
+            "timestamp": np.broadcast_to(np.asarray(timestamp, dtype=COLUMNS["timestamp"]), track_ids.shape).copy(),
+            "track_id": track_ids,
+            "x1": boxes[:, 0].copy(),
+            "y1": boxes[:, 1].copy(),
+            "x2": boxes[:, 2].copy(),
+            "y2": boxes[:, 3].copy(),
+            "confidence": np.asarray(confidences, dtype=COLUMNS["confidence"]).reshape(-1),
+        }
+        with self._lock:
+            latest = float(columns["timestamp"].max())
+            self._latest[session_id] = max(self._latest.get(session_id, latest), latest)
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((session_id, columns))
+        except queue.Full:
+            with self._lock:
+                self.dropped += len(track_ids)
+
+    def time_base(self, session_id: str) -> float:
+        """
+        Epoch time from which a recording of media time (a video) may stamp
+        its records: now, or the session's newest timestamp if that is
+        later. Every session uses one epoch time base, so live and video
+        records stay comparable and a session stays in time order.
+        """
+        base = time.time()
+        if not self.enabled or not session_id:
+            return base
+        index = self._load_index(session_id)
+        with self._lock:
+            latest = self._latest.get(session_id)
+        for ts in (latest, index.last_ts if index is not None else None):
+            if ts is not None:
+                base = max(base, ts)
+        return base
+
+    def _ensure_writer(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        pending: Dict[str, List[Dict[str, np.ndarray]]] = {}
+        pending_rows: Dict[str, int] = {}
+        oldest: Dict[str, float] = {}
+        while True:
+            try:
+                session_id, columns = self._queue.get(timeout=self.flush_interval)
+                pending.setdefault(session_id, []).append(columns)
+                pending_rows[session_id] = pending_rows.get(session_id, 0) + len(columns["track_id"])
+                oldest.setdefault(session_id, time.monotonic())
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            for sid in list(pending):
+                if pending_rows[sid] >= self.flush_rows or now - oldest[sid] >= self.flush_interval:
+                    chunks = pending.pop(sid)
+                    del pending_rows[sid], oldest[sid]
+                    try:
+                        self._write(sid, {name: np.concatenate([c[name] for c in chunks]) for name in COLUMNS})
+                    except Exception as e:
+                        logger.error(f"❌ History write failed for session {sid}: {e}")
+
+    def _load_index(self, session_id: str) -> Optional[_SessionIndex]:
+        """Cached index of a session; None if it has no history."""
+        with self._lock:
+            index = self._indexes.get(session_id)
+        if index is not None:
+            return index
+        path = os.path.join(self._session_dir(session_id), INDEX_FILE)
+        try:
+            with open(path) as f:
+                index = _SessionIndex(json.load(f))
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            return self._indexes.setdefault(session_id, index)
+
+    def _write(self, session_id: str, columns: Dict[str, np.ndarray]):
+        start = time.monotonic()
+        session_dir = self._session_dir(session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        index = self._load_index(session_id) or _SessionIndex()
+
+        # Drop any partial tail left by an interrupted write before appending
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(session_dir, f"{name}.bin")
+            with open(path, "ab") as f:
+                if f.tell() != index.rows * dtype.itemsize:
+                    f.truncate(index.rows * dtype.itemsize)
+                    f.seek(0, os.SEEK_END)
+                f.write(columns[name].astype(dtype, copy=False).tobytes())
+
+        # Readers only trust rows covered by the index, so it goes last
+        updated = _SessionIndex(index.to_dict())
+        updated.update(columns)
+        tmp_path = os.path.join(session_dir, INDEX_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(updated.to_dict(), f)
+        os.replace(tmp_path, os.path.join(session_dir, INDEX_FILE))
+
+        with self._lock:
+            self._indexes[session_id] = updated
+            self.rows_written += len(columns["track_id"])
+            self.batches_written += 1
+            self.write_time += time.monotonic() - start
+
+    def _open_columns(self, session_id: str, rows: int) -> Dict[str, np.ndarray]:
+        session_dir = self._session_dir(session_id)
+        return {
+            name: np.memmap(os.path.join(session_dir, f"{name}.bin"), dtype=dtype, mode="r", shape=(rows,))
+            for name, dtype in COLUMNS.items()
+        }
+
+    def query(self, session_id: str, start: float = None, end: float = None,
+              track_id: int = None, limit: int = HISTORY_QUERY_LIMIT) -> Optional[dict]:
+        """
+        Rows of a session with start <= timestamp < end, optionally for one
+        track, as a dict of column lists. None if the session does not exist.
+        Rows still buffered by the writer are not visible yet.
+        """
+        index = self._load_index(session_id)
+        if index is None:
+            return None
+        limit = max(0, min(limit, HISTORY_QUERY_LIMIT))
+        empty = {"session_id": session_id, "rows": 0, "truncated": False, **{name: [] for name in COLUMNS}}
+        if index.rows == 0:
+            return empty
+
+        lo, hi = 0, index.rows
+        if track_id is not None:
+            entry = index.tracks.get(track_id)
+            if entry is None:
+                return empty
+            lo, hi = entry[0], entry[1] + 1
+
+        columns = self._open_columns(session_id, index.rows)
+        ts = columns["timestamp"]
+        if index.sorted:
+            if start is not None:
+                lo = max(lo, int(np.searchsorted(ts, start, side="left")))
+            if end is not None:
+                hi = min(hi, int(np.searchsorted(ts, end, side="left")))
+        if hi <= lo:
+            return empty
+
+        mask = np.ones(hi - lo, dtype=bool)
+        if track_id is not None:
+            mask &= columns["track_id"][lo:hi] == track_id
+        if not index.sorted:
+            if start is not None:
+                mask &= ts[lo:hi] >= start
+            if end is not None:
+                mask &= ts[lo:hi] < end
+        rows = np.flatnonzero(mask)
+        truncated = len(rows) > limit
+        rows = rows[:limit] + lo
+
+        result = {"session_id": session_id, "rows": len(rows), "truncated": truncated}
+        for name in COLUMNS:
+            result[name] = np.asarray(columns[name][rows]).tolist()
+        return result
+
+    def tracks(self, session_id: str) -> Optional[dict]:
+        """Per-track summary straight from the index."""
+        index = self._load_index(session_id)
+        if index is None:
+            return None
+        return {
+            "session_id": session_id,
+            "rows": index.rows,
+            "first_ts": index.first_ts,
+            "last_ts": index.last_ts,
+            "tracks": [
+                {"id": track_id, "rows": entry[2], "first_ts": entry[3], "last_ts": entry[4]}
+                for track_id, entry in sorted(index.tracks.items())
+            ],
+        }
+
+    def sessions(self) -> List[str]:
+        if not self.enabled or not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, INDEX_FILE))
+        )
+
+    def stats(self) -> dict:
+        sessions = len(self.sessions())
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "root": self.root,
+                "sessions": sessions,
+                "rows_written": self.rows_written,
+                "batches_written": self.batches_written,
+                "avg_batch_rows": self.rows_written / self.batches_written if self.batches_written else 0.0,
+                "dropped_rows": self.dropped,
+                "queued_appends": self._queue.qsize(),
+                "write_time_s": round(self.write_time, 3),
+            }
+
+
+history_store = HistoryStore()
@@ -0,0 +1,208 @@
+# motion_gate.py
+import os
+import logging
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+MOTION_GATE_ENABLED = os.getenv("MOTION_GATE_ENABLED", "1") == "1"
+MOTION_GATE_WIDTH = int(os.getenv("MOTION_GATE_WIDTH", "160"))  # Width of the downscaled comparison frame
+MOTION_PIXEL_THRESHOLD = int(os.getenv("MOTION_PIXEL_THRESHOLD", "25"))  # Grey-level change counted as motion
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", "0.01"))  # Changed-pixel fraction that forces inference
+MOTION_FORCE_INTERVAL = int(os.getenv("MOTION_FORCE_INTERVAL", "30"))  # Full inference at least every N frames
+MOTION_GATE_MAX_STREAMS = int(os.getenv("MOTION_GATE_MAX_STREAMS", "256"))  # /detect streams with their own gate
+MOTION_GATE_IDLE_S = float(os.getenv("MOTION_GATE_IDLE_S", "300"))  # Gates of idle /detect streams are dropped
+
+
+class MotionGate:
+    """
+    Cheap per-stream motion gate in front of the detector.
+
+    Each frame is shrunk to a small blurred grey image and compared with the
+    frame the detector last ran on. The motion score is the fraction of
+    pixels that changed by more than MOTION_PIXEL_THRESHOLD. While the score
+    stays below the stream's threshold, the previous detections are reused
+    and the tracker coasts on them; inference is forced when the score
+    spikes past the threshold and at least every force_interval frames.
+    """
+
+    def __init__(
+        self,
+        threshold: float = MOTION_THRESHOLD,
+        force_interval: int = MOTION_FORCE_INTERVAL,
+        enabled: bool = MOTION_GATE_ENABLED
+    ):
+        self.threshold = threshold
+        self.force_interval = force_interval
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._reference: Optional[np.ndarray] = None
+        self._detections: Optional[np.ndarray] = None
+        self._shape = None
+        self._since_inference = 0
+        self._pending: Optional[np.ndarray] = None
+
+        self.frames = 0
+        self.gated_frames = 0
+        self.skipped_frames = 0
+        self.forced_frames = 0
+        self.last_score = 0.0
+
+    @staticmethod
+    def _signature(frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        width = min(MOTION_GATE_WIDTH, w)
+        height = max(1, int(h * width / w))
+        small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def score(self, signature: np.ndarray) -> float:
+        """Fraction of pixels that changed since the last inferred frame."""
+        if self._reference is None or self._reference.shape != signature.shape:
+            return 1.0
+        diff = cv2.absdiff(signature, self._reference)
+        return float(np.count_nonzero(diff > MOTION_PIXEL_THRESHOLD)) / diff.size
+
+    def reuse(self, frame: np.ndarray, skip: int = 0) -> Optional[np.ndarray]:
+        """
+        Return the previous detections if frame can skip inference, else None.
+        skip additionally reuses detections for that many frames after each
+        inference, regardless of motion. A None result must be followed by
+        commit() with the fresh detections.
+        """
+        signature = self._signature(frame) if self.enabled else None
+        with self._lock:
+            self.frames += 1
+            self._pending = signature
+            if frame.shape != self._shape:
+                # Resolution changed: previous boxes no longer apply
+                self._reference = None
+                self._detections = None
+                self._shape = frame.shape
+            if self._detections is not None and self._since_inference < skip:
+                self._since_inference += 1
+                self.skipped_frames += 1
+                return self._detections.copy()
+            if self.enabled:
+                self.last_score = self.score(signature)
+                forced = self._since_inference + 1 >= self.force_interval
+                if self._detections is not None and not forced and self.last_score < self.threshold:
+                    self._since_inference += 1
+                    self.gated_frames += 1
+                    return self._detections.copy()
+                if forced and self.last_score < self.threshold:
+                    self.forced_frames += 1
+        return None
+
+    def commit(self, detections: np.ndarray):
+        """Record fresh detections for the frame last passed to reuse()."""
+        with self._lock:
+            self._reference = self._pending
+            self._detections = np.array(detections, copy=True)
+            self._since_inference = 0
+
+    def gate(
+        self,
+        frame: np.ndarray,
+        detect: Callable[[np.ndarray], np.ndarray],
+        skip: int = 0
+    ) -> Tuple[np.ndarray, bool]:
+        """
+        Return (detections, reused) for frame. detect runs full inference and
+        is only called when the gate opens; reused is True when the previous
+        detections were returned instead.
+        """
+        detections = self.reuse(frame, skip)
+        if detections is not None:
+            return detections, True
+        detections = detect(frame)
+        self.commit(detections)
+        return detections, False
+
+    def reset(self):
+        with self._lock:
+            self._reference = None
+            self._detections = None
+            self._shape = None
+            self._since_inference = 0
+
+    @property
+    def gated_ratio(self) -> float:
+        return self.gated_frames / self.frames if self.frames else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "force_interval": self.force_interval,
+                "frames": self.frames,
+                "gated_frames": self.gated_frames,
+                "skipped_frames": self.skipped_frames,
+                "forced_frames": self.forced_frames,
+                "gated_ratio": self.gated_ratio,
+                "last_score": self.last_score,
+            }
+
+
+class MotionGateRegistry:
+    """
+    Motion gates for endpoints that receive one frame per request. Gating
+    is opt-in: only requests that name their stream get a gate, and each
+    stream has its own reference frame, detections and threshold, so one
+    client's detections are never reused for another client's frame.
+    Least recently used and idle streams are dropped.
+    """
+
+    def __init__(self, max_streams: int = MOTION_GATE_MAX_STREAMS, idle_s: float = MOTION_GATE_IDLE_S):
+        self.max_streams = max(1, max_streams)
+        self.idle_s = idle_s
+        self._gates: "OrderedDict[str, Tuple[MotionGate, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def get(self, stream_id: str, threshold: Optional[float] = None) -> MotionGate:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._gates.pop(stream_id, None)
+            gate = entry[0] if entry is not None else MotionGate()
+            if threshold is not None:
+                gate.threshold = threshold
+            self._gates[stream_id] = (gate, now)
+            while self._gates:
+                oldest_id, (_, last_used) = next(iter(self._gates.items()))
+                if len(self._gates) <= self.max_streams and now - last_used < self.idle_s:
+                    break
+                del self._gates[oldest_id]
+                self.evicted += 1
+            return gate
+
+    def stats(self) -> dict:
+        with self._lock:
+            gates = [gate for gate, _ in self._gates.values()]
+            evicted = self.evicted
+        frames = sum(g.frames for g in gates)
+        gated = sum(g.gated_frames for g in gates)
+        return {
+            "enabled": MOTION_GATE_ENABLED,
+            "streams": len(gates),
+            "evicted_streams": evicted,
+            "frames": frames,
+            "gated_frames": gated,
+            "skipped_frames": sum(g.skipped_frames for g in gates),
+            "forced_frames": sum(g.forced_frames for g in gates),
+            "gated_ratio": gated / frames if frames else 0.0,
+        }
+
+
+# Per-stream gates of /detect, keyed by the client's stream_id
+detect_gates = MotionGateRegistry()
@@ -0,0 +1,148 @@
+# progress.py
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+PROGRESS_MIN_INTERVAL_S = float(os.getenv("PROGRESS_MIN_INTERVAL_S", "0.5"))  # Minimum time between updates per job
+PROGRESS_QUEUE_SIZE = int(os.getenv("PROGRESS_QUEUE_SIZE", "4"))  # Updates buffered per subscriber; older ones are dropped
+PROGRESS_SEND_TIMEOUT_S = float(os.getenv("PROGRESS_SEND_TIMEOUT_S", "5"))  # Subscribers slower than this are disconnected
+
+# Final messages kept for subscribers that attach after a job finished
+FINISHED_JOBS_KEPT = 100
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+class _Subscriber:
+    def __init__(self, websocket: WebSocket, job_id: Optional[str], queue_size: int):
+        self.websocket = websocket
+        self.job_id = job_id  # None receives every job
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    def offer(self, message: str):
+        """Queue a message, discarding the oldest pending one when full."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class ProgressBroker:
+    """
+    Per-job progress pub/sub.
+
+    Jobs publish from the event loop without awaiting anything: each update
+    is throttled per job, serialized once and offered to the bounded queue
+    of every subscriber of that job (and of the catch-all /ws clients).
+    A sender task per subscriber drains its queue, so a slow or dead socket
+    only loses intermediate updates and never stalls the job.
+    """
+
+    def __init__(self, min_interval: float = PROGRESS_MIN_INTERVAL_S,
+                 queue_size: int = PROGRESS_QUEUE_SIZE, send_timeout: float = PROGRESS_SEND_TIMEOUT_S):
+        self.min_interval = min_interval
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self._subscribers: Dict[Optional[str], Set[_Subscriber]] = {}
+        self._last_publish: Dict[str, float] = {}
+        self._latest: Dict[str, str] = {}
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+
+        self.published = 0
+        self.throttled = 0
+        self.dropped = 0
+        self.send_failures = 0
+
+    def subscribe(self, websocket: WebSocket, job_id: Optional[str] = None) -> _Subscriber:
+        """Attach an accepted websocket to a job (or to all jobs with None)."""
+        sub = _Subscriber(websocket, job_id, self.queue_size)
+        self._subscribers.setdefault(job_id, set()).add(sub)
+        sub.task = asyncio.create_task(self._send_loop(sub))
+        # Late subscribers start from the job's most recent state
+        if job_id is not None and job_id in self._latest:
+            sub.offer(self._latest[job_id])
+        return sub
+
+    def unsubscribe(self, sub: _Subscriber):
+        subs = self._subscribers.get(sub.job_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.job_id]
+        self.dropped += sub.dropped
+        sub.dropped = 0
+        if sub.task is not None and sub.task is not asyncio.current_task():
+            sub.task.cancel()
+
+    def due(self, job_id: str) -> bool:
+        """Whether a throttled update for job_id would be sent now."""
+        return time.monotonic() - self._last_publish.get(job_id, 0.0) >= self.min_interval
+
+    def publish(self, job_id: str, message: dict, force: bool = False):
+        """Fan a progress message out to the job's subscribers; never blocks."""
+        if not force and not self.due(job_id):
+            self.throttled += 1
+            return
+        self._last_publish[job_id] = time.monotonic()
+        self._finished.pop(job_id, None)
+        data = json.dumps({"job_id": job_id, **message})
+        self._latest[job_id] = data
+        self.published += 1
+        for sub in self._subscribers.get(job_id, ()):
+            sub.offer(data)
+        for sub in self._subscribers.get(None, ()):
+            sub.offer(data)
+
+    def finish(self, job_id: str):
+        """Forget a job's throttle state; its last message stays for late subscribers."""
+        self._last_publish.pop(job_id, None)
+        self._finished[job_id] = None
+        while len(self._finished) > FINISHED_JOBS_KEPT:
+            stale, _ = self._finished.popitem(last=False)
+            self._latest.pop(stale, None)
+
+    async def _send_loop(self, sub: _Subscriber):
+        try:
+            while True:
+                message = await sub.queue.get()
+                await asyncio.wait_for(sub.websocket.send_text(message), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.send_failures += 1
+            logger.warning(f"📡 Dropping progress subscriber for job {sub.job_id or '*'}: {e!r}")
+            self.unsubscribe(sub)
+            # Close the socket so the client sees the drop and its handler exits
+            try:
+                await asyncio.wait_for(sub.websocket.close(code=1011), self.send_timeout)
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": sum(len(subs) for subs in self._subscribers.values()),
+            "jobs_with_subscribers": sorted(j for j in self._subscribers if j is not None),
+            "active_jobs": len(self._last_publish),
+            "published": self.published,
+            "throttled": self.throttled,
+            "dropped": self.dropped + sum(s.dropped for subs in self._subscribers.values() for s in subs),
+            "send_failures": self.send_failures,
+            "min_interval_s": self.min_interval,
+        }
+
+
+progress_broker = ProgressBroker()
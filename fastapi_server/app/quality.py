@@ -0,0 +1,215 @@
+# quality.py
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+QUALITY_LATENCY_SLO_MS = float(os.getenv("QUALITY_LATENCY_SLO_MS", "250"))  # Target p90 end-to-end latency
+QUALITY_QUEUE_LIMIT = int(os.getenv("QUALITY_QUEUE_LIMIT", "4"))  # In-flight requests before degrading
+QUALITY_WINDOW = int(os.getenv("QUALITY_WINDOW", "30"))  # Latency samples considered per decision
+QUALITY_HEADROOM = float(os.getenv("QUALITY_HEADROOM", "0.6"))  # Step up once p90 is below this share of the SLO
+QUALITY_COOLDOWN_S = float(os.getenv("QUALITY_COOLDOWN_S", "2.0"))  # Minimum time between level changes
+QUALITY_IDLE_S = float(os.getenv("QUALITY_IDLE_S", "10"))  # Step up once per this long without latency samples
+QUALITY_ADAPTIVE = os.getenv("QUALITY_ADAPTIVE", "1") == "1"
+
+
+class QualityLevel(NamedTuple):
+    index: int
+    scale: float     # detector input size relative to the endpoint's base size
+    skip: int        # frames reusing the previous detections after each inference; only applied
+                     # to gates of a single identified stream, never across clients
+    embedder: bool   # False switches DeepSORT to IoU/motion-only association
+
+    def detector_imgsz(self, base: int) -> Optional[int]:
+        """Detector input size for this level; None keeps the detector default."""
+        if self.scale >= 1.0:
+            return None
+        return max(160, int(base * self.scale) // 32 * 32)
+
+    def metadata(self) -> dict:
+        return {
+            "level": self.index,
+            "scale": self.scale,
+            "skip": self.skip,
+            "embedder": self.embedder,
+        }
+
+    def headers(self) -> dict:
+        return {
+            "X-Quality-Level": str(self.index),
+            "X-Quality-Skip": str(self.skip),
+            "X-Quality-Embedder": "1" if self.embedder else "0",
+        }
+
+
+# Degradation ladder, from full quality to cheapest
+QUALITY_LEVELS = [
+    QualityLevel(0, 1.0, 0, True),
+    QualityLevel(1, 0.8, 0, True),
+    QualityLevel(2, 0.65, 1, True),
+    QualityLevel(3, 0.5, 1, False),
+    QualityLevel(4, 0.5, 2, False),
+]
+
+
+class QualityController:
+    """
+    Load-adaptive quality controller.
+
+    Watches recent end-to-end latency and the number of in-flight requests
+    against the configured SLO and steps through QUALITY_LEVELS: down when
+    the p90 latency or queue depth exceeds the target, back up when there is
+    headroom again. Decisions are taken on every sample, on begin()/end()
+    and periodically by a monitor thread, so queue depth from bulk-only
+    load counts and a degraded level recovers one step per QUALITY_IDLE_S
+    once real-time traffic stops. Every change is logged and kept in a
+    short history.
+    """
+
+    def __init__(
+        self,
+        slo_ms: float = QUALITY_LATENCY_SLO_MS,
+        queue_limit: int = QUALITY_QUEUE_LIMIT,
+        window: int = QUALITY_WINDOW,
+        enabled: bool = QUALITY_ADAPTIVE
+    ):
+        self.slo_ms = slo_ms
+        self.queue_limit = queue_limit
+        self.enabled = enabled
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._index = 0
+        self._in_flight = 0
+        self._last_change = 0.0
+        self._last_sample = 0.0
+        self._monitor: Optional[threading.Thread] = None
+        self.history = deque(maxlen=50)
+
+    @property
+    def level(self) -> QualityLevel:
+        return QUALITY_LEVELS[self._index]
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def begin(self) -> float:
+        """Count a request as in flight; returns its start time for end()."""
+        with self._lock:
+            self._in_flight += 1
+            if self.enabled:
+                self._start_monitor()
+                self._evaluate()
+        return time.monotonic()
+
+    def end(self, start: float, record_latency: bool = True):
+        """
+        Finish a request started with begin(). Real-time work records its
+        end-to-end latency; bulk work only contributes to queue depth.
+        """
+        if record_latency:
+            latency_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            self._in_flight -= 1
+            if record_latency:
+                self._latencies.append(latency_ms)
+                self._last_sample = time.monotonic()
+            if self.enabled:
+                self._evaluate()
+
+    @contextmanager
+    def track(self, record_latency: bool = True):
+        """Context-manager form of begin()/end(); yields the current level."""
+        start = self.begin()
+        try:
+            yield self.level
+        finally:
+            self.end(start, record_latency)
+
+    def record(self, latency_ms: float):
+        with self._lock:
+            self._latencies.append(latency_ms)
+            self._last_sample = time.monotonic()
+            if self.enabled:
+                self._evaluate()
+
+    def _start_monitor(self):
+        """Start the periodic evaluation thread on first use; lock held."""
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._run_monitor, name="quality-monitor", daemon=True)
+            self._monitor.start()
+
+    def _run_monitor(self):
+        while True:
+            time.sleep(QUALITY_COOLDOWN_S)
+            with self._lock:
+                self._evaluate()
+
+    def _evaluate(self):
+        """Decide on a level change; called with the lock held."""
+        now = time.monotonic()
+        if now - self._last_change < QUALITY_COOLDOWN_S:
+            return
+        depth = self._in_flight
+        if self._latencies and now - self._last_sample >= QUALITY_IDLE_S:
+            # Samples from before real-time traffic stopped no longer apply
+            self._latencies.clear()
+
+        if len(self._latencies) < max(3, self._latencies.maxlen // 3):
+            # Too few samples to judge latency: queue depth alone can still
+            # degrade, and a level without real-time traffic recovers
+            idle = now - max(self._last_sample, self._last_change)
+            if depth > self.queue_limit and self._index < len(QUALITY_LEVELS) - 1:
+                self._set_level(self._index + 1, None, depth, "queue depth")
+            elif idle >= QUALITY_IDLE_S and depth <= self.queue_limit // 2 and self._index > 0:
+                self._set_level(self._index - 1, None, depth, "idle")
+            return
+
+        p90 = float(np.percentile(self._latencies, 90))
+        if (p90 > self.slo_ms or depth > self.queue_limit) and self._index < len(QUALITY_LEVELS) - 1:
+            self._set_level(self._index + 1, p90, depth, "over latency target" if p90 > self.slo_ms else "queue depth")
+        elif p90 < self.slo_ms * QUALITY_HEADROOM and depth <= self.queue_limit // 2 and self._index > 0:
+            self._set_level(self._index - 1, p90, depth, "headroom")
+
+    def _set_level(self, index: int, p90: Optional[float], depth: int, reason: str):
+        previous = self._index
+        self._index = index
+        self._last_change = time.monotonic()
+        # Judge the new level on its own latency samples
+        self._latencies.clear()
+        self.history.append({
+            "time": time.time(),
+            "from": previous,
+            "to": index,
+            "reason": reason,
+            "p90_ms": round(p90, 1) if p90 is not None else None,
+            "in_flight": depth,
+        })
+        log = logger.warning if index > previous else logger.info
+        latency = f"p90 {p90:.0f}ms vs SLO {self.slo_ms:.0f}ms" if p90 is not None else "no recent latency samples"
+        log(f"⚖️ Quality level {previous} → {index} ({reason}: {latency}, {depth} in flight)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            return {
+                "enabled": self.enabled,
+                "slo_ms": self.slo_ms,
+                "queue_limit": self.queue_limit,
+                "in_flight": self._in_flight,
+                "p90_ms": float(np.percentile(latencies, 90)) if latencies else None,
+                "current": self.level.metadata(),
+                "levels": [level.metadata() for level in QUALITY_LEVELS],
+                "history": list(self.history),
+            }
+
+
+quality_controller = QualityController()
@@ -0,0 +1,258 @@
+# result_cache.py
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from app.detector import CONF_THRESHOLD, IOU_THRESHOLD, loaded_fingerprint, weights_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # In-memory budget
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")  # Empty string disables the on-disk tier
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Rough per-entry bookkeeping cost (OrderedDict node, key string, array header)
+ENTRY_OVERHEAD = 256
+
+# Fingerprint of the weights whose results the disk tier holds
+MODEL_MARKER_FILE = "model.fingerprint"
+
+
+class ResultCache:
+    """
+    Content-addressed LRU cache of detection arrays.
+
+    Keys are a SHA-256 of the uploaded bytes plus the detector settings and
+    the fingerprint of the loaded weights, so a re-uploaded or retried image
+    is served without running YOLO again. The memory tier is bounded by a
+    byte budget; an optional directory adds a second, persistent tier of
+    .npy files. While the weights file on disk differs from the loaded
+    model the cache is bypassed; at startup the disk tier is cleared when
+    it was written by other weights.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str = "", disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._fingerprint = loaded_fingerprint
+        self._stale = False
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bypassed = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._check_disk_model()
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def make_key(self, data: bytes, resize_target) -> str:
+        """Hash the raw upload together with everything that affects detections."""
+        self.check_model()
+        h = hashlib.sha256(data)
+        h.update(
+            f"|conf={CONF_THRESHOLD}|iou={IOU_THRESHOLD}"
+            f"|resize={resize_target}|model={self._fingerprint}".encode()
+        )
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        if self._stale:
+            with self._lock:
+                self.bypassed += 1
+            return None
+        with self._lock:
+            dets = self._entries.get(key)
+            if dets is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dets.copy()
+
+        dets = self._disk_get(key)
+        with self._lock:
+            if dets is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, dets)
+        return dets.copy()
+
+    def put(self, key: str, dets: np.ndarray):
+        if self._stale:
+            return
+        dets = np.ascontiguousarray(dets, dtype=float)
+        with self._lock:
+            self._insert(key, dets.copy())
+        self._disk_put(key, dets)
+
+    def invalidate(self, reason: str = "manual"):
+        """Drop every cached result from both tiers."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+            if self.disk_dir:
+                for path, _, _ in self._disk_files():
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self._disk_bytes = 0
+        logger.info(f"🧹 Result cache invalidated ({reason})")
+
+    def check_model(self):
+        """
+        Bypass the cache while the weights file differs from the loaded model:
+        results of the running model must not be stored under the new
+        weights. Entries of the new weights are keyed by their own
+        fingerprint once the server is restarted with them.
+        """
+        stale = weights_fingerprint() != self._fingerprint
+        if stale and not self._stale:
+            logger.warning("⚠️ Model weights changed on disk; result cache bypassed until the server is restarted")
+        self._stale = stale
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_enabled": self.disk_dir is not None,
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "bypassed": self.bypassed,
+                "model_changed_on_disk": self._stale,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    # ── internal helpers ──
+
+    @staticmethod
+    def _entry_size(key: str, dets: np.ndarray) -> int:
+        return dets.nbytes + len(key) + ENTRY_OVERHEAD
+
+    def _insert(self, key: str, dets: np.ndarray):
+        """Insert under the lock and evict least-recently-used entries over budget."""
+        size = self._entry_size(key, dets)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= self._entry_size(key, old)
+        self._entries[key] = dets
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            old_key, old_dets = self._entries.popitem(last=False)
+            self._bytes -= self._entry_size(old_key, old_dets)
+            self.evictions += 1
+
+    def _check_disk_model(self):
+        """
+        Clear the disk tier if it was filled by other weights (or by a
+        version without a marker), then record the loaded weights. Their
+        entries could never be hit again but would keep using the budget.
+        """
+        marker = os.path.join(self.disk_dir, MODEL_MARKER_FILE)
+        try:
+            with open(marker) as f:
+                previous = f.read().strip()
+        except FileNotFoundError:
+            previous = None
+        if previous != self._fingerprint:
+            if previous is not None or self._disk_files():
+                self.invalidate("model weights changed since the disk tier was written")
+            try:
+                with open(marker, "w") as f:
+                    f.write(self._fingerprint)
+            except OSError as e:
+                logger.warning(f"Could not write cache model marker {marker}: {e}")
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.npy")
+
+    def _disk_files(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _disk_get(self, key: str) -> Optional[np.ndarray]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            dets = np.load(path, allow_pickle=False)
+            os.utime(path)  # refresh recency for disk-tier eviction
+            return dets
+        except Exception as e:
+            logger.warning(f"Could not read cached result {path}: {e}")
+            return None
+
+    def _disk_put(self, key: str, dets: np.ndarray):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, dets, allow_pickle=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not write cached result {path}: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += os.path.getsize(path)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._prune_disk()
+
+    def _prune_disk(self):
+        """Remove the oldest files until the disk tier is back under 90% of its budget."""
+        files = sorted(self._disk_files(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in files)
+        target = int(self.disk_max_bytes * 0.9)
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+
+result_cache = ResultCache(
+    RESULT_CACHE_MAX_BYTES,
+    disk_dir=RESULT_CACHE_DIR,
+    disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES,
+)
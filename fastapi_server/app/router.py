@@ -1,8 +1,23 @@
-from fastapi import APIRouter, UploadFile, File, Form, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, UploadFile, File, Form, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
-from app.schemas import DetectionResponse, DetectionBox
-from app.detector import detect_objects, get_class_name
-from app.deepsort_tracker import track_objects, tracker, create_tracker, smoothers
+from app.schemas import DetectionResponse
+from app.detector import detect_objects, detect_objects_batch, get_class_name, inference_lock
+from app.deepsort_tracker import track_objects, tracker, TrackingSession
+from app.result_cache import result_cache
+from app.video_encoder import create_video_writer, ENCODERS, X264_PRESETS
+from app import track_stream
+from app.focus import focus_controller
+from app.motion_gate import MotionGate, detect_gates
+from app.quality import quality_controller
+from app.stream_engine import stream_engine
+from app import chunked_video
+from app.video_io import FrameRange, iter_frames
+from app.history_store import history_store, is_valid_session_id
+from app.progress import progress_broker, new_job_id
+from app.admission import admission, AdmissionRejected, ADMISSION_MEMORY_FACTOR, BULK
+from app.serialization import (
+    LAYOUTS, ENCODINGS, negotiate, normalize_boxes, box_fields, layout_boxes, encoded_response, send_encoded
+)
 import traceback
 import cv2
 import numpy as np
@@ -11,11 +26,12 @@ import gc  # For garbage collection
 import os
 from tempfile import NamedTemporaryFile
 from typing import List
-import json
 from starlette.background import BackgroundTask
 import time
 import logging
 import base64
+import asyncio
+import functools
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,22 +46,19 @@ MAX_HEIGHT = 640
 # Maximum number of detections to process
 MAX_DETECTIONS = 100
 
-# Add WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+# Use smaller dimensions for video detection to improve performance
+MAX_DETECTION_WIDTH = 384
+MAX_DETECTION_HEIGHT = 384
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def send_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-manager = ConnectionManager()
+def fit_dimensions(width, height):
+    """Dimensions resize_image_if_needed() produces for a width x height image"""
+    if width <= MAX_WIDTH and height <= MAX_HEIGHT:
+        return width, height
+    
+    # Calculate new dimensions while maintaining aspect ratio
+    if width > height:
+        return MAX_WIDTH, int(height * (MAX_WIDTH / width))
+    return int(width * (MAX_HEIGHT / height)), MAX_HEIGHT
 
 def resize_image_if_needed(image):
     """Resize image if it exceeds maximum dimensions while maintaining aspect ratio"""
@@ -54,17 +67,54 @@ def resize_image_if_needed(image):
     if width <= MAX_WIDTH and height <= MAX_HEIGHT:
         return image
     
-    # Calculate new dimensions while maintaining aspect ratio
-    if width > height:
-        new_width = MAX_WIDTH
-        new_height = int(height * (MAX_WIDTH / width))
-    else:
-        new_height = MAX_HEIGHT
-        new_width = int(width * (MAX_HEIGHT / height))
-    
+    new_width, new_height = fit_dimensions(width, height)
     print(f"📏 Resizing image from {width}x{height} to {new_width}x{new_height}")
     return cv2.resize(image, (new_width, new_height))
 
+def detect_cached(image_bytes: bytes, image, imgsz: int = None):
+    """Run detect_objects() on the resized image, serving repeated uploads from the result cache."""
+    key = result_cache.make_key(image_bytes, (MAX_WIDTH, MAX_HEIGHT, imgsz))
+    detections = result_cache.get(key)
+    if detections is not None:
+        return detections
+    try:
+        detections, _ = detect_objects(image, raise_on_error=True, imgsz=imgsz)
+    except Exception:
+        # Failed inference is reported as no detections but never cached
+        return np.empty((0, 6), dtype=float)
+    result_cache.put(key, detections)
+    return detections
+
+def detect_batch_cached(images_bytes: List[bytes], images) -> List[np.ndarray]:
+    """Batch counterpart of detect_cached(): only cache misses go through YOLO."""
+    keys = [result_cache.make_key(data, (MAX_WIDTH, MAX_HEIGHT, None)) for data in images_bytes]
+    outputs = [result_cache.get(key) for key in keys]
+    missing = [i for i, dets in enumerate(outputs) if dets is None]
+    if missing:
+        try:
+            fresh = detect_objects_batch([images[i] for i in missing], raise_on_error=True)
+        except Exception:
+            fresh = None
+        for j, i in enumerate(missing):
+            if fresh is None:
+                outputs[i] = np.empty((0, 6))
+            else:
+                outputs[i] = fresh[j]
+                result_cache.put(keys[i], fresh[j])
+    return outputs
+
+def video_iterator(path):
+    """Stream an output video file in 1 MiB chunks, removing it afterwards."""
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), b""):
+            yield chunk
+    # Close file explicitly before attempting deletion
+    # We don't use a background task for deletion to avoid permission issues
+    try:
+        os.remove(path)
+    except Exception as e:
+        logger.warning(f"Could not remove output temp file: {e}")
+
 def compute_iou(box1, box2):
     """Compute IoU between two boxes [x1,y1,x2,y2]"""
     x1, y1, x2, y2 = box1
@@ -77,8 +127,79 @@ def compute_iou(box1, box2):
     union_area = box1_area + box2_area - inter_area
     return inter_area / union_area if union_area > 0 else 0
 
+def match_confidences(boxes, detections, iou_threshold=0.5):
+    """Confidence of the best-overlapping detection for each box (0.0 below iou_threshold)"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    confidences = np.zeros(len(boxes), dtype=np.float64)
+    if len(boxes) == 0 or len(detections) == 0:
+        return confidences
+    dets = np.asarray(detections, dtype=np.float64)
+    xi1 = np.maximum(boxes[:, None, 0], dets[None, :, 0])
+    yi1 = np.maximum(boxes[:, None, 1], dets[None, :, 1])
+    xi2 = np.minimum(boxes[:, None, 2], dets[None, :, 2])
+    yi2 = np.minimum(boxes[:, None, 3], dets[None, :, 3])
+    inter = np.clip(xi2 - xi1, 0, None) * np.clip(yi2 - yi1, 0, None)
+    box_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    det_area = (dets[:, 2] - dets[:, 0]) * (dets[:, 3] - dets[:, 1])
+    union = box_area[:, None] + det_area[None, :] - inter
+    ious = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+    best = ious.argmax(axis=1)
+    matched = ious[np.arange(len(boxes)), best] > iou_threshold
+    confidences[matched] = dets[best[matched], 4]
+    return confidences
+
+def request_cost(request: Request, factor: float = ADMISSION_MEMORY_FACTOR) -> int:
+    """Memory estimate for admission control, from the upload size"""
+    return int(int(request.headers.get("content-length") or 0) * factor)
+
+def rejected_response(e: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"error": str(e), "reason": e.reason, "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def cleanup_stream(ticket, path):
+    """Release the admission slot and input file of a streamed response once it is over"""
+    admission.release(ticket)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass  # already removed by the generator
+
+def invalid_layout_response(layout):
+    return JSONResponse(status_code=400, content={"error": f"Unsupported layout: {layout}"})
+
+def invalid_session_response():
+    return JSONResponse(
+        status_code=400,
+        content={"error": "session_id must be 1-64 characters of letters, digits, '_' or '-'"}
+    )
+
 @router.post("/detect", response_model=DetectionResponse)
-async def detect(file: UploadFile = File(...), focus_id: int = Form(None)):
+async def detect(
+    request: Request,
+    file: UploadFile = File(...),
+    focus_id: int = Form(None),
+    motion_threshold: float = Form(None),  # Per-stream motion gate threshold (changed-pixel fraction)
+    session_id: str = Form(None),  # Record the tracks in this history session
+    stream_id: str = Form(None),  # Client camera stream; enables motion gating (defaults to session_id)
+    layout: str = Form("rows"),  # "rows" (default schema) or "columns"
+    accept: str = Header(None)  # application/msgpack selects msgpack, anything else JSON
+):
+    if session_id is not None and not is_valid_session_id(session_id):
+        return invalid_session_response()
+    stream_id = stream_id or session_id
+    if layout not in LAYOUTS:
+        return invalid_layout_response(layout)
+    try:
+        ticket = await admission.acquire("interactive", request_cost(request))
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    # Quality level chosen by the load-adaptive controller for this request
+    level = quality_controller.level
+    imgsz = level.detector_imgsz(MAX_WIDTH)
+    started = quality_controller.begin()
     try:
         # Read image bytes
         image_bytes = await file.read()
@@ -93,10 +214,30 @@ async def detect(file: UploadFile = File(...), focus_id: int = Form(None)):
         # Resize image to max 640x640 for memory management
         image = resize_image_if_needed(image)
         
-        # Run detection on resized image
-        detections, processed_image = detect_objects(image)
+        # Run detection on resized image (repeated uploads are served from cache).
+        # With a focus_id, YOLO only runs on a crop around the focused track.
+        def run_detection(img):
+            if focus_id is not None:
+                return focus_controller.detect(
+                    img, focus_id, lambda full: detect_cached(image_bytes, full, imgsz), stream_id=stream_id
+                )
+            return detect_cached(image_bytes, img, imgsz)
+
+        # Frames of an identified stream reuse that stream's previous
+        # detections while its scene is static; anonymous requests always run
+        # detection, since consecutive requests may come from different clients
+        if stream_id:
+            gate = detect_gates.get(stream_id, motion_threshold)
+            detect = functools.partial(gate.gate, image, run_detection, skip=level.skip)
+        else:
+            detect = lambda: (run_detection(image), False)
+        # Inference waits for its turn on the model lock; that wait happens in
+        # a worker thread so the event loop keeps serving other requests.
+        # Tracking stays on the loop, which serializes the shared tracker.
+        detections, gated = await asyncio.get_running_loop().run_in_executor(None, detect)
+        processed_image = image
         logger.info(f"📸 Received image of shape: {image.shape}")
-        logger.info(f"📦 Detections: {len(detections)}")
+        logger.info(f"📦 Detections: {len(detections)}{' (motion-gated)' if gated else ''}")
         
         # Limit the number of detections processed
         if len(detections) > MAX_DETECTIONS:
@@ -108,48 +249,46 @@ async def detect(file: UploadFile = File(...), focus_id: int = Form(None)):
             detections,
             processed_image,
             focus_id,
-            return_raw_detections=True
+            return_raw_detections=True,
+            use_embedder=level.embedder
         )
+        if focus_id is not None:
+            focus_controller.record_result(focus_id, track_results, stream_id=stream_id)
         
-        # Build response with only person boxes using IoU matching
-        detection_boxes = []
-        for x1, y1, x2, y2, track_id, class_id in track_results:
-            track_box = [x1, y1, x2, y2]
-            conf = 0.0
-            
-            # Find best matching detection using IoU
-            if detections.size > 0:
-                ious = [compute_iou(track_box, det[:4]) for det in detections]
-                if ious:
-                    max_iou_idx = np.argmax(ious)
-                    if ious[max_iou_idx] > 0.5:  # IoU threshold
-                        conf = float(detections[max_iou_idx][4])
-            
-            h, w = processed_image.shape[:2]
-            detection_boxes.append(
-                DetectionBox(
-                    id=int(track_id),
-                    label="person",
-                    confidence=conf,
-                    x1=x1 / w,   # normalize by image width
-                    y1=y1 / h,   # normalize by image height
-                    x2=x2 / w,
-                    y2=y2 / h
-                )
-            )
+        # Build response with only person boxes; confidence comes from the
+        # best-overlapping detection (IoU matching)
+        h, w = processed_image.shape[:2]
+        results = np.asarray(track_results, dtype=np.float64).reshape(-1, 6)
+        boxes = normalize_boxes(results[:, :4], w, h)
+        confidences = match_confidences(results[:, :4], detections)
+        
+        if session_id:
+            history_store.append(session_id, time.time(), results[:, 4], boxes, confidences)
         
         # Cleanup
         del processed_image, image
         gc.collect()
         
-        logger.info(f"✅ Processed image with {len(detection_boxes)} tracked detections")
-        return DetectionResponse(results=detection_boxes)
+        logger.info(f"✅ Processed image with {len(results)} tracked detections")
+        fields = box_fields(results[:, 4], boxes, label="person", confidence=confidences)
+        return encoded_response(
+            {"results": layout_boxes(fields, layout)},
+            negotiate(accept),
+            headers=level.headers()
+        )
     except Exception as e:
         logger.error(f"❌ Error in /detect endpoint: {e}", exc_info=True)
         return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        quality_controller.end(started)
+        admission.release(ticket)
 
 @router.post("/process_image")
-async def process_image(file: UploadFile = File(...)):
+async def process_image(request: Request, file: UploadFile = File(...)):
+    try:
+        ticket = await admission.acquire("interactive", request_cost(request))
+    except AdmissionRejected as e:
+        return rejected_response(e)
     try:
         # Read image bytes
         image_bytes = await file.read()
@@ -167,8 +306,11 @@ async def process_image(file: UploadFile = File(...)):
         # Start timing
         start_time = time.time()
         
-        # Run detection on resized image
-        detections, _ = detect_objects(image)
+        # Run detection on resized image (repeated uploads are served from
+        # cache); the model lock is awaited in a worker thread
+        detections = await asyncio.get_running_loop().run_in_executor(
+            None, detect_cached, image_bytes, image
+        )
         
         # Calculate processing time
         processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
@@ -221,25 +363,73 @@ async def process_image(file: UploadFile = File(...)):
     except Exception as e:
         logger.error(f"Error in /process_image endpoint: {e}", exc_info=True)
         return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        admission.release(ticket)
 
-@router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def serve_progress(websocket: WebSocket, job_id: str = None):
+    """Keep a progress subscription open until the client disconnects."""
+    await websocket.accept()
+    sub = progress_broker.subscribe(websocket, job_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            # Handle incoming messages if needed
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
+            await websocket.receive_text()
+            # Incoming messages are ignored; updates are sent by the broker
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the broker closed a subscriber that fell behind
+        pass
+    finally:
+        progress_broker.unsubscribe(sub)
+
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    # Legacy endpoint: progress of every job
+    await serve_progress(websocket)
+
+@router.websocket("/ws/progress/{job_id}")
+async def ws_progress(websocket: WebSocket, job_id: str):
+    await serve_progress(websocket, job_id)
 
 @router.post("/process_video")
 async def process_video(
+    request: Request,
     file: UploadFile = File(...), 
     skip_frames: int = Form(0),  # Default to processing every 3rd frame
-    full_resolution: bool = Form(True)  # Changed default to True
+    full_resolution: bool = Form(True),  # Changed default to True
+    encoder: str = Form(None),  # "ffmpeg" (H.264) or "opencv" (mp4v); defaults to VIDEO_ENCODER
+    preset: str = Form(None),  # libx264 preset, e.g. "veryfast"
+    crf: int = Form(None),  # libx264 constant rate factor (0-51)
+    motion_gate: bool = Form(True),  # Skip YOLO on frames without motion
+    motion_threshold: float = Form(None),  # Changed-pixel fraction that forces inference
+    parallel_chunks: int = Form(0),  # >1 splits long videos across worker processes
+    start: float = Form(0.0),  # Start of the analysed range in seconds
+    end: float = Form(None),  # End of the analysed range in seconds (default: end of video)
+    sample_fps: float = Form(None),  # Analyse only this many frames per second
+    session_id: str = Form(None),  # Record the tracks in this history session (epoch time base + video position)
+    job_id: str = Form(None)  # Progress is published under this id (generated when omitted) on /ws/progress/{job_id}
 ):
+    if session_id is not None and not is_valid_session_id(session_id):
+        return invalid_session_response()
+    if encoder is not None and encoder not in ENCODERS:
+        return JSONResponse(status_code=400, content={"error": f"Unsupported encoder: {encoder}"})
+    if preset is not None and preset not in X264_PRESETS:
+        return JSONResponse(status_code=400, content={"error": f"Unsupported preset: {preset}"})
+    if session_id is not None and parallel_chunks > 1:
+        # Chunk workers do not report detection confidences for the history
+        return JSONResponse(status_code=400, content={"error": "session_id is not supported with parallel_chunks"})
+    # Video jobs are bulk work: they queue for a slot and yield the model to
+    # interactive frames. The upload is held in memory once while copied.
+    try:
+        ticket = await admission.acquire("bulk", request_cost(request, factor=1))
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    job_id = job_id or new_job_id()
     in_tmp = None
     out_tmp = None
+    # Video jobs count towards the controller's queue depth but not its latency
+    started = quality_controller.begin()
+    # The association mode is fixed for the job: switching between appearance
+    # and motion-only matching mid-video would mix feature galleries
+    use_embedder = quality_controller.level.embedder
     try:
         # Validate skip_frames
         skip_frames = max(0, min(skip_frames, 5))  # Limit to 0-5 range
@@ -252,6 +442,18 @@ async def process_video(
         in_tmp.flush()
         in_tmp.close()  # Release the OS lock
         
+        # Chunked mode covers the whole video; ranged/sampled requests are
+        # already cheap and run on the single-process path. Chunks beyond the
+        # pool size would only queue, and a single chunk is slower than the
+        # single-process path (decoded twice, plus a stitch and a concat)
+        ranged = bool(start) or end is not None or bool(sample_fps)
+        chunks = min(parallel_chunks, chunked_video.worker_count())
+        if chunks > 1 and not ranged:
+            return await process_video_chunked(
+                in_tmp.name, job_id, chunks, encoder, preset, crf,
+                full_resolution, skip_frames, motion_gate, motion_threshold
+            )
+        
         cap = cv2.VideoCapture(in_tmp.name)
 
         if not cap.isOpened():
@@ -263,31 +465,31 @@ async def process_video(
         fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
+        # Only frames in [start, end) at sample_fps are decoded into images;
+        # the rest are skipped with grab()
+        frame_range = FrameRange(fps, total_frames, start, end, sample_fps)
+        selected_frames = len(frame_range)
+        
         # Calculate expected processing frames and time
-        expected_processed_frames = total_frames // (skip_frames + 1) + 1
+        expected_processed_frames = selected_frames
         estimated_time = expected_processed_frames * 0.4  # Assuming 400ms per frame
 
-        # Use smaller dimensions for detection to improve performance
-        MAX_DETECTION_WIDTH = 384
-        MAX_DETECTION_HEIGHT = 384
-        
         logger.info(f"✅ Input video: {original_width}x{original_height} @ {fps}fps")
-        logger.info(f"Total frames: {total_frames}, Expected to process: {expected_processed_frames}")
+        logger.info(
+            f"Total frames: {total_frames}, range: {frame_range.start}-{frame_range.end or 'end'} "
+            f"@ {frame_range.output_fps:.1f}fps, Expected to process: {expected_processed_frames}"
+        )
         logger.info(f"Estimated processing time: {estimated_time:.1f} seconds")
 
         # Initialize statistics
-        processed_frames = 0
         unique_track_ids = set()  # Track unique IDs instead of total detections
         start_time = time.time()
         
-        # Read first frame to get resized size
-        ret, frame = cap.read()
-        if not ret:
-            raise RuntimeError("❌ Failed to read first frame")
-
-        # Get resized dimensions for detection
-        resized = resize_image_if_needed(frame.copy()) if not full_resolution else frame
-        resized_height, resized_width = resized.shape[:2]
+        # Get resized dimensions for detection from the stream properties
+        if full_resolution:
+            resized_width, resized_height = original_width, original_height
+        else:
+            resized_width, resized_height = fit_dimensions(original_width, original_height)
         logger.info(f"✅ Processing dimensions: {resized_width}x{resized_height}")
         
         # Calculate scale factors
@@ -296,15 +498,19 @@ async def process_video(
         
         logger.info(f"✅ Output dimensions: {original_width}x{original_height} (scale: {scale_x}x, {scale_y}y)")
 
-        # Create video writer with appropriate dimensions
+        # Create video writer with appropriate dimensions; the ffmpeg backend
+        # encodes H.264 in a background thread while we keep running inference
         out_tmp = NamedTemporaryFile(suffix=".mp4", delete=False)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        writer = cv2.VideoWriter(
-            out_tmp.name, 
-            fourcc, 
-            fps, 
-            (original_width, original_height) if full_resolution else (resized_width, resized_height)
+        out_tmp.close()
+        writer = create_video_writer(
+            out_tmp.name,
+            frame_range.output_fps,
+            (original_width, original_height) if full_resolution else (resized_width, resized_height),
+            encoder=encoder,
+            preset=preset,
+            crf=crf
         )
+        logger.info(f"✅ Video encoder: {writer.name}")
         
         if not writer.isOpened():
             raise RuntimeError("❌ Failed to create video writer")
@@ -312,130 +518,178 @@ async def process_video(
         # Reset tracker and smoothing state is now handled by factory
         # tracker.reset_tracks() -- removed
 
-        # Initialize processing variables
-        frame_i = 0
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        last_track_results = []  # Store last known tracking results
-        
-        # For websocket progress updates
-        for websocket in manager.active_connections:
-            await websocket.send_text(json.dumps({
-                "type": "progress",
-                "progress": 0.0,
-                "total_frames": total_frames
-            }))
+        # Per-job motion gate: static frames reuse the previous detections
+        gate = MotionGate(enabled=motion_gate)
+        if motion_threshold is not None:
+            gate.threshold = motion_threshold
+
+        # Each job keeps its own tracker state; detection is batched across
+        # all active jobs by the shared stream engine
+        session = TrackingSession()
+        stream_id = stream_engine.open_stream()
+
+        # History records are epoch timestamps like those of /detect and
+        # /ws/track: the job's start (or the session's newest record, if
+        # later) plus the frame's position in the video
+        history_base = history_store.time_base(session_id) if session_id else None
+
+        # Progress goes through the broker; subscribers are served by their
+        # own tasks, so publishing never waits on a socket
+        progress_broker.publish(job_id, {
+            "type": "progress",
+            "progress": 0.0,
+            "total_frames": selected_frames
+        }, force=True)
         
-        # Main processing loop
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
-            # Update progress every 10 frames
-            if frame_i % 10 == 0:
-                progress = frame_i / max(total_frames, 1)
-                elapsed_time = time.time() - start_time
-                estimated_total = elapsed_time / max(progress, 0.01)
-                remaining_time = max(0, estimated_total - elapsed_time)
-                
-                progress_info = {
-                    "type": "progress",
-                    "progress": progress,
-                    "frame": frame_i,
-                    "total_frames": total_frames,
-                    "elapsed_time": f"{elapsed_time:.1f}s",
-                    "remaining_time": f"{remaining_time:.1f}s",
-                    "processed_frames": processed_frames,
-                    "unique_tracks": len(unique_track_ids)
-                }
+        # Main processing loop; decoding runs to the end of the range or of
+        # the stream, selected_frames is only the header's estimate.
+        # The per-frame pipeline (decode, resize, tracking, drawing, encoder
+        # hand-off) runs in a worker thread so concurrent jobs use separate
+        # cores; only YOLO is shared, batched by the stream engine
+        loop = asyncio.get_running_loop()
+
+        def run_frames():
+            frame_i = processed_frames = 0
+            last_track_results = []  # Store last known tracking results
+            end_frame = frame_range.start
+            for source_i, frame in iter_frames(cap, frame_range):
+                end_frame = source_i + 1
+                # Update progress at most every PROGRESS_MIN_INTERVAL_S
+                if progress_broker.due(job_id):
+                    progress = min(frame_i / max(selected_frames, 1), 0.99)
+                    elapsed_time = time.time() - start_time
+                    estimated_total = elapsed_time / max(progress, 0.01)
+                    remaining_time = max(0, estimated_total - elapsed_time)
                 
-                for websocket in manager.active_connections:
-                    await websocket.send_text(json.dumps(progress_info))
+                    progress_info = {
+                        "type": "progress",
+                        "progress": progress,
+                        "frame": frame_i,
+                        "total_frames": selected_frames,
+                        "elapsed_time": f"{elapsed_time:.1f}s",
+                        "remaining_time": f"{remaining_time:.1f}s",
+                        "processed_frames": processed_frames,
+                        "unique_tracks": len(unique_track_ids)
+                    }
+                    loop.call_soon_threadsafe(progress_broker.publish, job_id, progress_info)
             
-            # Process frame at appropriate resolution
-            img_small = resize_image_if_needed(frame.copy()) if not full_resolution else frame
+                # Process frame at appropriate resolution
+                img_small = resize_image_if_needed(frame.copy()) if not full_resolution else frame
             
-            # Further downsize for detection if needed
-            if img_small.shape[1] > MAX_DETECTION_WIDTH or img_small.shape[0] > MAX_DETECTION_HEIGHT:
-                detection_scale = min(MAX_DETECTION_WIDTH / img_small.shape[1], 
-                                     MAX_DETECTION_HEIGHT / img_small.shape[0])
-                detection_width = int(img_small.shape[1] * detection_scale)
-                detection_height = int(img_small.shape[0] * detection_scale)
-                detection_img = cv2.resize(img_small, (detection_width, detection_height))
-            else:
-                detection_img = img_small
+                # Quality level picked by the load-adaptive controller for this
+                # frame. It only changes YOLO's input size (imgsz) and the skip
+                # count: the detection image keeps one size for the whole job so
+                # the tracker's Kalman and smoothing state stay in one pixel space
+                level = quality_controller.level
+                imgsz = level.detector_imgsz(MAX_DETECTION_WIDTH)
+            
+                # Further downsize for detection if needed
+                if img_small.shape[1] > MAX_DETECTION_WIDTH or img_small.shape[0] > MAX_DETECTION_HEIGHT:
+                    detection_scale = min(MAX_DETECTION_WIDTH / img_small.shape[1], 
+                                         MAX_DETECTION_HEIGHT / img_small.shape[0])
+                    detection_width = int(img_small.shape[1] * detection_scale)
+                    detection_height = int(img_small.shape[0] * detection_scale)
+                    detection_img = cv2.resize(img_small, (detection_width, detection_height))
+                else:
+                    detection_img = img_small
                 
-            # Run detection on selected frames
-            dets, _ = detect_objects(detection_img)
-            processed_frames += 1
+                # Run detection on selected frames, unless nothing moved; skipped
+                # frames reuse the previous detections
+                dets = gate.reuse(detection_img, skip=max(skip_frames, level.skip))
+                if dets is None:
+                    dets = stream_engine.submit(stream_id, detection_img, imgsz).result()
+                    gate.commit(dets)
+                processed_frames += 1
+            
+                # Get tracking results
+                track_results = track_objects(
+                    dets,
+                    detection_img,
+                    return_raw_detections=True,
+                    use_embedder=use_embedder,
+                    session=session
+                )
             
-            # Get tracking results
-            track_results = track_objects(dets, detection_img, return_raw_detections=True)
+                # Update unique track IDs
+                for _, _, _, _, track_id, _ in track_results:
+                    unique_track_ids.add(track_id)
             
-            # Update unique track IDs
-            for _, _, _, _, track_id, _ in track_results:
-                unique_track_ids.add(track_id)
+                if session_id and track_results:
+                    results = np.asarray(track_results, dtype=np.float32)
+                    det_h, det_w = detection_img.shape[:2]
+                    history_store.append(
+                        session_id,
+                        history_base + source_i / frame_range.fps,
+                        results[:, 4],
+                        results[:, :4] / [det_w, det_h, det_w, det_h],
+                        match_confidences(results[:, :4], dets)
+                    )
             
-            # Store last known good tracking results
-            if track_results:
-                last_track_results = track_results
+                # Store last known good tracking results
+                if track_results:
+                    last_track_results = track_results
             
-            # Always draw on original frame for perfect alignment
-            draw_frame = frame
+                # Always draw on original frame for perfect alignment
+                draw_frame = frame
             
-            # Draw boxes for confirmed tracks
-            for x1, y1, x2, y2, track_id, _ in track_results:
-                # Always map from detection_img → original frame
-                det_w = detection_img.shape[1]
-                det_h = detection_img.shape[0]
-                scale_x = original_width / det_w
-                scale_y = original_height / det_h
-                x1 = int(x1 * scale_x)
-                y1 = int(y1 * scale_y)
-                x2 = int(x2 * scale_x)
-                y2 = int(y2 * scale_y)
+                # Draw boxes for confirmed tracks
+                for x1, y1, x2, y2, track_id, _ in track_results:
+                    # Always map from detection_img → original frame
+                    det_w = detection_img.shape[1]
+                    det_h = detection_img.shape[0]
+                    scale_x = original_width / det_w
+                    scale_y = original_height / det_h
+                    x1 = int(x1 * scale_x)
+                    y1 = int(y1 * scale_y)
+                    x2 = int(x2 * scale_x)
+                    y2 = int(y2 * scale_y)
                 
-                # Draw bounding box
-                cv2.rectangle(draw_frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                label = f"person {track_id}"
-                cv2.putText(draw_frame, label, (int(x1), int(y1)-10),
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+                    # Draw bounding box
+                    cv2.rectangle(draw_frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+                    label = f"person {track_id}"
+                    cv2.putText(draw_frame, label, (int(x1), int(y1)-10),
+                              cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
             
-            # Write the processed frame
-            writer.write(draw_frame)
-            frame_i += 1
+                # Write the processed frame; the ffmpeg backend blocks this
+                # thread while its queue is full
+                writer.write(draw_frame)
+                frame_i += 1
             
-            # Log progress periodically
-            if frame_i % 30 == 0:
-                current_time = time.time()
-                elapsed = current_time - start_time
-                fps_processing = processed_frames / elapsed if elapsed > 0 else 0
-                logger.info(
-                    f"Frame {frame_i}/{total_frames} "
-                    f"({processed_frames} processed, "
-                    f"{len(unique_track_ids)} unique tracks, "
-                    f"~{fps_processing:.1f} FPS)"
-                )
+                # Log progress periodically
+                if frame_i % 30 == 0:
+                    current_time = time.time()
+                    elapsed = current_time - start_time
+                    fps_processing = processed_frames / elapsed if elapsed > 0 else 0
+                    logger.info(
+                        f"Frame {frame_i}/{selected_frames} "
+                        f"({processed_frames} processed, "
+                        f"{len(unique_track_ids)} unique tracks, "
+                        f"{gate.gated_ratio:.0%} gated, "
+                        f"~{fps_processing:.1f} FPS)"
+                    )
+
+                # Clean up memory
+                del dets
+                gc.collect()
+
+            return frame_i, processed_frames, end_frame
 
-            # Clean up memory
-            del dets
-            gc.collect()
+        frame_i, processed_frames, end_frame = await loop.run_in_executor(None, run_frames)
 
-        # Release resources
+        # Release resources; flushing the encoder waits for ffmpeg to finish
         cap.release()
-        writer.release()
+        await asyncio.get_running_loop().run_in_executor(None, writer.release)
+        selected_frames = frame_i
         
         # Final progress update
-        for websocket in manager.active_connections:
-            await websocket.send_text(json.dumps({
-                "type": "progress",
-                "progress": 1.0
-            }))
-        
-        # ── FULLY RE-INIT TRACKER BETWEEN RUNS ──
-        # throw away the old one and its EMA history
-        tracker = create_tracker()
-        smoothers.clear()
+        progress_broker.publish(job_id, {
+            "type": "progress",
+            "progress": 1.0,
+            "frame": frame_i,
+            "total_frames": selected_frames,
+            "processed_frames": processed_frames,
+            "unique_tracks": len(unique_track_ids)
+        }, force=True)
         
         # Calculate final statistics
         processing_time = time.time() - start_time
@@ -450,34 +704,40 @@ async def process_video(
             raise RuntimeError("❌ Output video file is too small or empty")
 
         # Return video stream with statistics
-        def video_iterator(path):
-            with open(path, "rb") as f:
-                for chunk in iter(lambda: f.read(1024*1024), b""):
-                    yield chunk
-            # Close file explicitly before attempting deletion
-            # We don't use a background task for deletion to avoid permission issues
-            try:
-                os.remove(path)
-            except Exception as e:
-                logger.warning(f"Could not remove output temp file: {e}")
-        
         # Return without background task to avoid permission errors
         return StreamingResponse(
             video_iterator(out_tmp.name), 
             media_type="video/mp4",
             headers={
+                "X-Job-Id": job_id,
                 "X-Total-Frames": str(total_frames),
+                "X-Selected-Frames": str(selected_frames),
+                "X-Start-Frame": str(frame_range.start),
+                "X-End-Frame": str(end_frame),
+                "X-Sample-Fps": f"{frame_range.output_fps:.2f}",
                 "X-Processed-Frames": str(processed_frames),
                 "X-Total-Detections": str(len(unique_track_ids)),  # Now shows unique tracks
                 "X-Avg-Detections": f"{avg_detections:.2f}",
                 "X-Processing-Time": f"{processing_time:.1f}",
-                "X-Frame-Rate": f"{effective_fps:.1f}"
+                "X-Frame-Rate": f"{effective_fps:.1f}",
+                "X-Video-Encoder": writer.name,
+                "X-Gated-Frames": str(gate.gated_frames),
+                "X-Gated-Ratio": f"{gate.gated_ratio:.2f}",
+                "X-Skipped-Frames": str(gate.skipped_frames),
+                **({"X-History-Time-Base": f"{history_base:.6f}"} if session_id else {}),
+                **quality_controller.level.headers()
             }
         )
     except Exception as e:
         logger.error(f"Error in /process_video endpoint: {e}", exc_info=True)
+        progress_broker.publish(job_id, {"type": "error", "error": str(e)}, force=True)
         return JSONResponse(status_code=500, content={"error": str(e)})
     finally:
+        progress_broker.finish(job_id)
+        quality_controller.end(started, record_latency=False)
+        admission.release(ticket)
+        if 'stream_id' in locals():
+            stream_engine.close_stream(stream_id)
         if in_tmp is not None:
             try:
                 os.remove(in_tmp.name)
@@ -493,39 +753,237 @@ async def process_video(
         except Exception as ex:
             logger.warning(f"Error closing video resources: {ex}")
 
+async def process_video_chunked(
+    path: str,
+    job_id: str,
+    chunks: int,
+    encoder: str,
+    preset: str,
+    crf: int,
+    full_resolution: bool,
+    skip_frames: int,
+    motion_gate: bool,
+    motion_threshold: float
+):
+    """
+    Long-video mode of /process_video: keyframe-aligned chunks are tracked in
+    parallel worker processes, stitched and concatenated. Progress is
+    published under job_id as each chunk is tracked and rendered. The caller
+    removes the input file and finishes the job.
+    """
+    output_size = None
+    if not full_resolution:
+        cap = cv2.VideoCapture(path)
+        output_size = fit_dimensions(
+            int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        )
+        cap.release()
+    out_tmp = NamedTemporaryFile(suffix=".mp4", delete=False)
+    out_tmp.close()
+    progress_broker.publish(job_id, {"type": "progress", "progress": 0.0, "chunks": chunks}, force=True)
+    try:
+        loop = asyncio.get_running_loop()
+
+        def on_progress(message: dict):
+            # Called from the executor thread; the broker lives on the loop
+            loop.call_soon_threadsafe(functools.partial(progress_broker.publish, job_id, message, force=True))
+
+        stats = await loop.run_in_executor(
+            None,
+            functools.partial(
+                chunked_video.process_video_chunked,
+                path,
+                out_tmp.name,
+                chunks,
+                MAX_DETECTION_WIDTH,
+                MAX_DETECTION_HEIGHT,
+                {"encoder": encoder, "preset": preset, "crf": crf},
+                output_size=output_size,
+                skip_frames=skip_frames,
+                motion_gate=motion_gate,
+                motion_threshold=motion_threshold,
+                on_progress=on_progress
+            )
+        )
+    except chunked_video.EmptyVideoError as e:
+        os.remove(out_tmp.name)
+        progress_broker.publish(job_id, {"type": "error", "error": str(e)}, force=True)
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception:
+        os.remove(out_tmp.name)
+        raise
+
+    processing_time = stats["processing_time"]
+    effective_fps = stats["processed_frames"] / processing_time if processing_time > 0 else 0
+    logger.info(
+        f"✅ Chunked processing finished: {stats['processed_frames']} frames in "
+        f"{stats['chunks']} chunks, {stats['unique_tracks']} tracks, {processing_time:.1f}s"
+    )
+    progress_broker.publish(job_id, {
+        "type": "progress",
+        "progress": 1.0,
+        "frame": stats["processed_frames"],
+        "total_frames": stats["total_frames"],
+        "processed_frames": stats["processed_frames"],
+        "unique_tracks": stats["unique_tracks"]
+    }, force=True)
+    return StreamingResponse(
+        video_iterator(out_tmp.name),
+        media_type="video/mp4",
+        headers={
+            "X-Job-Id": job_id,
+            "X-Total-Frames": str(stats["total_frames"]),
+            "X-Processed-Frames": str(stats["processed_frames"]),
+            "X-Total-Detections": str(stats["unique_tracks"]),
+            "X-Processing-Time": f"{processing_time:.1f}",
+            "X-Frame-Rate": f"{effective_fps:.1f}",
+            "X-Chunks": str(stats["chunks"])
+        }
+    )
+
+@router.post("/analyze_video")
+async def analyze_video(
+    request: Request,
+    file: UploadFile = File(...),
+    format: str = Form("ndjson"),  # "ndjson" or "binary"
+    start: float = Form(0.0),  # Start of the analysed range in seconds
+    end: float = Form(None),  # End of the analysed range in seconds
+    sample_fps: float = Form(None)  # Analyse only this many frames per second
+):
+    """
+    Tracks-only mode: stream per-frame track records and a per-track summary
+    without drawing boxes or re-encoding the video.
+    """
+    if format not in track_stream.FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"Unsupported format: {format}"})
+    try:
+        ticket = await admission.acquire("bulk", request_cost(request, factor=1))
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    in_tmp = None
+    try:
+        contents = await file.read()
+        in_tmp = NamedTemporaryFile(suffix=".mp4", delete=False)
+        in_tmp.write(contents)
+        in_tmp.close()
+        del contents
+
+        # Unreadable input is reported with a status before the stream starts
+        error = await asyncio.get_running_loop().run_in_executor(None, track_stream.check_video, in_tmp.name)
+        if error is not None:
+            admission.release(ticket)
+            os.remove(in_tmp.name)
+            return JSONResponse(status_code=400, content={"error": error})
+
+        # The response owns the temp file and the admission slot from here
+        # on; its background task frees both once the stream is over, also
+        # when the client leaves before the generator ever starts
+        return StreamingResponse(
+            track_stream.analyze_video(
+                in_tmp.name, format, MAX_DETECTION_WIDTH, MAX_DETECTION_HEIGHT,
+                start=start, end=end, sample_fps=sample_fps
+            ),
+            media_type=track_stream.FORMATS[format],
+            background=BackgroundTask(cleanup_stream, ticket, in_tmp.name)
+        )
+    except Exception as e:
+        logger.error(f"Error in /analyze_video endpoint: {e}", exc_info=True)
+        admission.release(ticket)
+        if in_tmp is not None:
+            try:
+                os.remove(in_tmp.name)
+            except Exception:
+                pass
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
 @router.websocket("/ws/track")
 async def ws_track(websocket: WebSocket):
     await websocket.accept()
+    # Each connection is its own stream with its own motion gate
+    gate = MotionGate()
+    if "motion_threshold" in websocket.query_params:
+        gate.threshold = float(websocket.query_params["motion_threshold"])
+    session_id = websocket.query_params.get("session_id")
+    layout = websocket.query_params.get("layout", "rows")
+    encoding = websocket.query_params.get("encoding", "json")
+    if (session_id is not None and not is_valid_session_id(session_id)) \
+            or layout not in LAYOUTS or encoding not in ENCODINGS:
+        await websocket.close(code=1008)
+        return
+    # Recorded connections run their own tracker so the history holds
+    # track ids; the association mode is fixed for the connection
+    session = TrackingSession() if session_id else None
+    use_embedder = quality_controller.level.embedder
     while True:
         # 1) receive raw JPEG bytes
         frame_bytes = await websocket.receive_bytes()
-        # 2) decode to OpenCV image
-        nparr = np.frombuffer(frame_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is None:
+        # Frames over the interactive budget are dropped with a notice
+        try:
+            ticket = await admission.acquire("interactive", len(frame_bytes) * ADMISSION_MEMORY_FACTOR)
+        except AdmissionRejected as e:
+            await send_encoded(websocket, {
+                "type": "rejected",
+                "reason": e.reason,
+                "retry_after": e.retry_after
+            }, encoding)
             continue
-        h, w = img.shape[:2]
-        # 3) detect & get absolute boxes
-        dets, _ = detect_objects(img)
-        # 4) normalize and build JSON
-        boxes = []
-        for idx, (x1, y1, x2, y2, conf, cls) in enumerate(dets):
-            boxes.append({
-              "id": idx,
-              "x1": x1 / w,
-              "y1": y1 / h,
-              "x2": x2 / w,
-              "y2": y2 / h,
-              "conf": conf
-            })
-        # 5) send back a JSON text message
-        await websocket.send_json({"type": "track", "boxes": boxes})
+        try:
+            with quality_controller.track() as level:
+                # 2) decode to OpenCV image
+                nparr = np.frombuffer(frame_bytes, np.uint8)
+                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                if img is None:
+                    continue
+                h, w = img.shape[:2]
+                imgsz = level.detector_imgsz(MAX_WIDTH)
+                # 3) detect & get absolute boxes (reused while the scene is static);
+                # the model lock is awaited in a worker thread, off the event loop
+                dets, gated = await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                    gate.gate, img, lambda frame: detect_objects(frame, imgsz=imgsz)[0], skip=level.skip
+                ))
+                # 4) normalize straight from the detection array
+                dets = np.asarray(dets, dtype=np.float64).reshape(-1, 6)
+                ids = np.arange(len(dets))
+                boxes = normalize_boxes(dets[:, :4], w, h)
+                if session is not None:
+                    tracks = np.asarray(track_objects(
+                        dets, img, return_raw_detections=True, use_embedder=use_embedder, session=session
+                    ), dtype=np.float64).reshape(-1, 6)
+                    history_store.append(
+                        session_id,
+                        time.time(),
+                        tracks[:, 4],
+                        normalize_boxes(tracks[:, :4], w, h),
+                        match_confidences(tracks[:, :4], dets)
+                    )
+        finally:
+            admission.release(ticket)
+        # 5) send back a JSON text (or msgpack binary) message
+        await send_encoded(websocket, {
+            "type": "track",
+            "boxes": layout_boxes(box_fields(ids, boxes, conf=dets[:, 4]), layout),
+            "gated": gated,
+            "gated_ratio": gate.gated_ratio,
+            "quality": level.metadata()
+        }, encoding)
 
 @router.post("/detect_batch")
-async def detect_batch(files: List[UploadFile] = File(...)):
+async def detect_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    layout: str = Form("rows"),  # "rows" (default schema) or "columns"
+    accept: str = Header(None)  # application/msgpack selects msgpack, anything else JSON
+):
+    if layout not in LAYOUTS:
+        return invalid_layout_response(layout)
+    try:
+        ticket = await admission.acquire("bulk", request_cost(request))
+    except AdmissionRejected as e:
+        return rejected_response(e)
     try:
         # 1) Decode & resize all incoming frames
         images = []
+        images_bytes = []
         for f in files:
             data = await f.read()
             arr = np.frombuffer(data, np.uint8)
@@ -533,104 +991,111 @@ async def detect_batch(files: List[UploadFile] = File(...)):
             if img is None:
                 raise ValueError(f"Failed to decode image from {f.filename}")
             images.append(resize_image_if_needed(img))
+            images_bytes.append(data)
 
         logger.info(f"📸 Processing batch of {len(images)} images")
 
-        # 2) Run batched YOLO
-        batch_dets = detect_objects_batch(images)
+        # 2) Run batched YOLO on the frames that are not cached yet, off the
+        # event loop so interactive requests are served while it waits
+        batch_dets = await asyncio.get_running_loop().run_in_executor(
+            None, detect_batch_cached, images_bytes, images
+        )
 
         # 3) Run a single tracker pass over the sequence
         tracker.reset_tracks()
         all_frames = []
         for i, (img, dets) in enumerate(zip(images, batch_dets)):
-            tracks = track_objects(dets, img, return_raw_detections=True)
+            tracks = np.asarray(track_objects(dets, img, return_raw_detections=True), dtype=np.float64).reshape(-1, 6)
             
-            # 4) build serializable list of boxes
-            frame_boxes = []
-            for x1, y1, x2, y2, tid, _ in tracks:
-                # Find matching detection with highest IoU for confidence score
-                conf = 0.0
-                if dets.size > 0:
-                    ious = [compute_iou([x1,y1,x2,y2], det[:4]) for det in dets]
-                    if ious:
-                        max_iou_idx = np.argmax(ious)
-                        if ious[max_iou_idx] > 0.5:  # IoU threshold
-                            conf = float(dets[max_iou_idx][4])
-                
-                h, w = img.shape[:2]
-                frame_boxes.append({
-                    "id": int(tid),
-                    "label": "person",
-                    "confidence": conf,
-                    "x1": x1 / w,
-                    "y1": y1 / h,
-                    "x2": x2 / w,
-                    "y2": y2 / h
-                })
-            all_frames.append(frame_boxes)
+            # 4) normalized boxes, confidence from the best-overlapping detection
+            h, w = img.shape[:2]
+            fields = box_fields(
+                tracks[:, 4],
+                normalize_boxes(tracks[:, :4], w, h),
+                label="person",
+                confidence=match_confidences(tracks[:, :4], dets)
+            )
+            all_frames.append(layout_boxes(fields, layout))
             
-            logger.info(f"Frame {i}: {len(frame_boxes)} tracked objects")
+            logger.info(f"Frame {i}: {len(tracks)} tracked objects")
 
         # Cleanup
-        del images, batch_dets
+        del images, images_bytes, batch_dets
         gc.collect()
 
-        return {"frames": all_frames}
+        return encoded_response({"frames": all_frames}, negotiate(accept))
     except Exception as e:
         logger.error(f"❌ Error in /detect_batch endpoint: {e}", exc_info=True)
         return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        admission.release(ticket)
 
 @router.websocket("/ws/batch")
 async def ws_batch(websocket: WebSocket):
     await websocket.accept()
+    layout = websocket.query_params.get("layout", "rows")
+    encoding = websocket.query_params.get("encoding", "json")
+    if layout not in LAYOUTS or encoding not in ENCODINGS:
+        await websocket.close(code=1008)
+        return
     try:
         while True:
             # Receive batch message
             data = await websocket.receive_json()
             
             if data['type'] == 'batch_frames':
-                frames = []
-                # Decode frames from base64
-                for frame_data in data['frames']:
-                    frame_bytes = base64.b64decode(frame_data)
-                    np_arr = np.frombuffer(frame_bytes, np.uint8)
-                    frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-                    if frame is not None:
-                        frames.append(frame)
-                
-                if not frames:
+                # Base64 is 4/3 of the encoded frame size
+                cost = sum(len(f) for f in data['frames']) * 3 // 4 * ADMISSION_MEMORY_FACTOR
+                try:
+                    ticket = await admission.acquire("bulk", cost)
+                except AdmissionRejected as e:
+                    await send_encoded(websocket, {
+                        'type': 'rejected',
+                        'reason': e.reason,
+                        'retry_after': e.retry_after,
+                        'timestamp': data['timestamp']
+                    }, encoding)
                     continue
+                try:
+                    frames = []
+                    # Decode frames from base64
+                    for frame_data in data['frames']:
+                        frame_bytes = base64.b64decode(frame_data)
+                        np_arr = np.frombuffer(frame_bytes, np.uint8)
+                        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+                        if frame is not None:
+                            frames.append(frame)
                 
-                # Process frames in batch
-                batch_results = []
-                for frame in frames:
-                    # Run detection
-                    dets, _ = detect_objects(frame)
-                    
-                    # Run tracking
-                    track_results = track_objects(dets, frame, return_raw_detections=True)
-                    
-                    # Convert results to normalized coordinates
-                    frame_height, frame_width = frame.shape[:2]
-                    normalized_results = []
+                    # Process frames in batch
+                    loop = asyncio.get_running_loop()
+                    batch_results = []
+                    for frame in frames:
+                        # Run detection; bulk work waits behind interactive
+                        # frames, so the wait happens in a worker thread
+                        dets, _ = await loop.run_in_executor(
+                            None, functools.partial(detect_objects, frame, priority=BULK)
+                        )
                     
-                    for x1, y1, x2, y2, track_id, _ in track_results:
-                        normalized_results.append({
-                            'id': int(track_id),
-                            'x1': float(x1 / frame_width),
-                            'y1': float(y1 / frame_height),
-                            'x2': float(x2 / frame_width),
-                            'y2': float(y2 / frame_height)
-                        })
+                        # Run tracking
+                        track_results = track_objects(dets, frame, return_raw_detections=True)
                     
-                    batch_results.append(normalized_results)
+                        # Convert results to normalized coordinates
+                        frame_height, frame_width = frame.shape[:2]
+                        results = np.asarray(track_results, dtype=np.float64).reshape(-1, 6)
+                        boxes = normalize_boxes(results[:, :4], frame_width, frame_height)
+                        batch_results.append(layout_boxes(box_fields(results[:, 4], boxes), layout))
+                finally:
+                    admission.release(ticket)
+                
+                if not frames:
+                    continue
                 
                 # Send batch results
-                await websocket.send_json({
+                await send_encoded(websocket, {
                     'type': 'batch_results',
                     'results': batch_results,
                     'timestamp': data['timestamp']
-                })
+                }, encoding)
                 
     except WebSocketDisconnect:
         print("WebSocket batch client disconnected")
@@ -641,3 +1106,69 @@ async def ws_batch(websocket: WebSocket):
             await websocket.close()
         except:
             pass
+
+@router.get("/history")
+async def history_sessions():
+    return {"sessions": history_store.sessions()}
+
+@router.get("/history/stats")
+async def history_stats():
+    return history_store.stats()
+
+@router.get("/history/{session_id}")
+async def history_query(
+    session_id: str,
+    start: float = None,
+    end: float = None,
+    track_id: int = None,
+    limit: int = 1000
+):
+    """Track records of a session with start <= timestamp < end, as columns"""
+    if not is_valid_session_id(session_id):
+        return invalid_session_response()
+    result = history_store.query(session_id, start, end, track_id, limit)
+    if result is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown session: {session_id}"})
+    return result
+
+@router.get("/history/{session_id}/tracks")
+async def history_tracks(session_id: str):
+    if not is_valid_session_id(session_id):
+        return invalid_session_response()
+    result = history_store.tracks(session_id)
+    if result is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown session: {session_id}"})
+    return result
+
+@router.get("/progress/stats")
+async def progress_stats():
+    return progress_broker.stats()
+
+@router.get("/admission/stats")
+async def admission_stats():
+    return {**admission.stats(), "inference_lock": inference_lock.stats()}
+
+@router.get("/focus/stats")
+async def focus_stats():
+    return focus_controller.stats()
+
+@router.get("/streams/stats")
+async def streams_stats():
+    return stream_engine.stats()
+
+@router.get("/quality/stats")
+async def quality_stats():
+    return quality_controller.stats()
+
+@router.get("/motion/stats")
+async def motion_stats():
+    return detect_gates.stats()
+
+@router.get("/cache/stats")
+async def cache_stats():
+    return result_cache.stats()
+
+@router.post("/cache/invalidate")
+async def cache_invalidate():
+    result_cache.invalidate("requested via API")
+    return result_cache.stats()
@@ -0,0 +1,96 @@
+# serialization.py
+"""
+Fast response path for detection results.
+
+Boxes are kept as NumPy columns until the response is written, then
+encoded with orjson (default) or msgpack, chosen by the ``Accept`` header
+or, for WebSockets, an ``encoding`` query parameter.
+
+Two layouts are supported:
+
+* ``rows`` (default): one object per box, exactly the existing schema, e.g.
+  ``[{"id": 1, "label": "person", "confidence": 0.9, "x1": ..., ...}]``.
+* ``columns``: one array per field, e.g.
+  ``{"id": [1, 2], "label": "person", "confidence": [0.9, 0.8], "x1": [...], ...}``;
+  constant fields stay scalars.
+"""
+from itertools import repeat
+from typing import Any, Dict
+
+import msgpack
+import numpy as np
+import orjson
+from fastapi import WebSocket
+from fastapi.responses import Response
+
+LAYOUTS = ("rows", "columns")
+ENCODINGS = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+}
+_MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def negotiate(accept: str) -> str:
+    """Encoding for an Accept header; JSON unless msgpack is asked for."""
+    accept = (accept or "").lower()
+    return "msgpack" if any(media in accept for media in _MSGPACK_TYPES) else "json"
+
+
+def normalize_boxes(boxes, width: int, height: int) -> np.ndarray:
+    """(N, 4) pixel x1, y1, x2, y2 to coordinates normalized to [0,1]."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return boxes / np.array([width, height, width, height], dtype=np.float64)
+
+
+def box_fields(ids, boxes: np.ndarray, **extra) -> Dict[str, Any]:
+    """Named columns for a set of boxes; extra fields are arrays or constants."""
+    fields = {"id": np.asarray(ids).astype(np.int64, copy=False)}
+    fields.update(extra)
+    fields["x1"] = boxes[:, 0]
+    fields["y1"] = boxes[:, 1]
+    fields["x2"] = boxes[:, 2]
+    fields["y2"] = boxes[:, 3]
+    return fields
+
+
+def layout_boxes(fields: Dict[str, Any], layout: str = "rows"):
+    """Arrange box columns as a list of objects or as an object of arrays."""
+    if layout == "columns":
+        return {
+            name: np.ascontiguousarray(value) if isinstance(value, np.ndarray) else value
+            for name, value in fields.items()
+        }
+    columns = [
+        value.tolist() if isinstance(value, np.ndarray) else repeat(value)
+        for value in fields.values()
+    ]
+    names = list(fields)
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+
+def encode(payload, encoding: str = "json") -> bytes:
+    if encoding == "msgpack":
+        return msgpack.packb(payload, default=_msgpack_default, use_bin_type=True)
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def encoded_response(payload, encoding: str = "json", headers: dict = None) -> Response:
+    return Response(content=encode(payload, encoding), media_type=ENCODINGS[encoding], headers=headers)
+
+
+async def send_encoded(websocket: WebSocket, payload, encoding: str = "json"):
+    """Send msgpack as a binary message and JSON as a text message."""
+    data = encode(payload, encoding)
+    if encoding == "msgpack":
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data.decode())
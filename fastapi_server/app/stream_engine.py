@@ -0,0 +1,154 @@
+# stream_engine.py
+import os
+import time
+import logging
+import itertools
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.detector import detect_objects_batch
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "8"))  # Maximum frames per shared inference batch
+STREAM_BATCH_WAIT_MS = float(os.getenv("STREAM_BATCH_WAIT_MS", "4"))  # Time to wait for more streams to fill a batch
+
+
+class _Stream:
+    def __init__(self, stream_id: int):
+        self.id = stream_id
+        self.pending = deque()  # (image, imgsz, future)
+        self.frames = 0
+
+
+class MultiStreamEngine:
+    """
+    Shared inference engine for concurrent video jobs.
+
+    Every job keeps its own decoder and tracker state and submits frames
+    here. A single worker thread gathers pending frames from all active
+    streams into one detect_objects_batch() call, taking frames round-robin
+    (one per stream per pass, rotating the starting stream) so a long video
+    cannot starve the others.
+    """
+
+    def __init__(self, batch_size: int = STREAM_BATCH_SIZE, batch_wait_ms: float = STREAM_BATCH_WAIT_MS):
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000.0
+        self._streams: "OrderedDict[int, _Stream]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+        self.batches = 0
+        self.frames = 0
+        self.max_batch = 0
+        self.busy_time = 0.0
+
+    def open_stream(self) -> int:
+        with self._cond:
+            stream_id = next(self._ids)
+            self._streams[stream_id] = _Stream(stream_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="stream-engine", daemon=True)
+                self._thread.start()
+        logger.info(f"🎞️ Stream {stream_id} opened ({len(self._streams)} active)")
+        return stream_id
+
+    def close_stream(self, stream_id: int):
+        with self._cond:
+            stream = self._streams.pop(stream_id, None)
+        if stream is None:
+            return
+        for _, _, future in stream.pending:
+            future.cancel()
+        logger.info(f"🎞️ Stream {stream_id} closed after {stream.frames} frames ({len(self._streams)} active)")
+
+    def submit(self, stream_id: int, image: np.ndarray, imgsz: int = None) -> Future:
+        """Queue a frame for detection; the future resolves to its detection array."""
+        future: Future = Future()
+        with self._cond:
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                raise KeyError(f"Unknown stream {stream_id}")
+            stream.pending.append((image, imgsz, future))
+            self._cond.notify()
+        return future
+
+    def _next_batch(self) -> List[tuple]:
+        """Wait for work, then take frames round-robin across streams."""
+        with self._cond:
+            while not any(s.pending for s in self._streams.values()):
+                self._cond.wait()
+            # Give the other streams a moment to contribute to this batch
+            deadline = time.monotonic() + self.batch_wait
+            while True:
+                waiting = sum(1 for s in self._streams.values() if s.pending)
+                remaining = deadline - time.monotonic()
+                if waiting >= min(len(self._streams), self.batch_size) or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            while len(batch) < self.batch_size:
+                took = False
+                for stream in list(self._streams.values()):
+                    if stream.pending and len(batch) < self.batch_size:
+                        image, imgsz, future = stream.pending.popleft()
+                        if future.set_running_or_notify_cancel():
+                            batch.append((stream, image, imgsz, future))
+                        took = True
+                if not took:
+                    break
+            # Rotate so the next batch starts with a different stream
+            if self._streams:
+                first = next(iter(self._streams))
+                self._streams.move_to_end(first)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            start = time.monotonic()
+            # Frames can only share a forward pass at the same input size
+            groups: Dict[Optional[int], list] = {}
+            for item in batch:
+                groups.setdefault(item[2], []).append(item)
+            for imgsz, items in groups.items():
+                try:
+                    outputs = detect_objects_batch([image for _, image, _, _ in items], imgsz=imgsz)
+                except Exception as e:
+                    for _, _, _, future in items:
+                        future.set_exception(e)
+                    continue
+                for (stream, _, _, future), dets in zip(items, outputs):
+                    stream.frames += 1
+                    future.set_result(dets)
+            with self._cond:
+                self.batches += 1
+                self.frames += len(batch)
+                self.max_batch = max(self.max_batch, len(batch))
+                self.busy_time += time.monotonic() - start
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "active_streams": len(self._streams),
+                "pending_frames": sum(len(s.pending) for s in self._streams.values()),
+                "batches": self.batches,
+                "frames": self.frames,
+                "avg_batch_size": self.frames / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch,
+                "inference_fps": self.frames / self.busy_time if self.busy_time > 0 else 0.0,
+                "streams": {s.id: s.frames for s in self._streams.values()},
+            }
+
+
+stream_engine = MultiStreamEngine()
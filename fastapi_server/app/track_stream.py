@@ -0,0 +1,216 @@
+# track_stream.py
+"""
+Tracks-only video analysis.
+
+Frames are decoded, shrunk straight to detection resolution, detected and
+tracked; nothing is drawn or re-encoded. Per-frame track records are streamed
+while processing runs, followed by a per-track summary.
+
+Frame indices and times always refer to the source video, so results for a
+time range or a sampled subset line up with the original timeline.
+
+Two wire formats are supported:
+
+* ``ndjson``: one JSON object per line. Frame records look like
+  ``{"type": "frame", "frame": 12, "time": 0.4, "tracks": [{"id": 1, "x1": ..., ...}]}``
+  with coordinates normalized to [0,1]; the last line is the summary
+  ``{"type": "summary", ...}``.
+* ``binary``: the magic ``b"TRK1"`` followed by frame records, each a
+  ``<IfH`` header (frame index, time in seconds, track count) and ``count``
+  ``<i4f`` entries (track id, normalized x1, y1, x2, y2). The summary is sent
+  as a record with frame index ``0xFFFFFFFF`` followed by a ``<I`` byte length
+  and the UTF-8 JSON summary.
+
+If processing fails after the stream has started, the last record is an
+error instead of the summary: ``{"type": "error", "error": ...}``, framed
+like the summary in the binary format.
+"""
+import os
+import json
+import struct
+import logging
+from typing import Dict, Iterator, List, Optional
+
+import cv2
+import numpy as np
+
+from app.deepsort_tracker import track_objects, TrackingSession
+from app.stream_engine import stream_engine
+from app.video_io import FrameRange, iter_frames
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of path points kept per track in the summary
+TRACK_PATH_MAX_POINTS = int(os.getenv("TRACK_PATH_MAX_POINTS", "500"))
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "binary": "application/octet-stream",
+}
+
+BINARY_MAGIC = b"TRK1"
+SUMMARY_MARKER = 0xFFFFFFFF
+_FRAME_HEADER = struct.Struct("<IfH")
+_TRACK_ENTRY = struct.Struct("<i4f")
+_LENGTH = struct.Struct("<I")
+
+
+class TrackSummary:
+    """Accumulates first/last frame and the center path of every track."""
+
+    def __init__(self, fps: float):
+        self.fps = fps
+        self.tracks: Dict[int, dict] = {}
+
+    def update(self, frame_i: int, tracks: List[dict]):
+        for t in tracks:
+            entry = self.tracks.get(t["id"])
+            if entry is None:
+                entry = {"id": t["id"], "first_frame": frame_i, "last_frame": frame_i, "frames": 0, "path": []}
+                self.tracks[t["id"]] = entry
+            entry["last_frame"] = frame_i
+            entry["frames"] += 1
+            entry["path"].append([
+                frame_i,
+                round((t["x1"] + t["x2"]) / 2, 4),
+                round((t["y1"] + t["y2"]) / 2, 4),
+            ])
+
+    def to_dict(self, total_frames: int) -> dict:
+        tracks = []
+        for entry in sorted(self.tracks.values(), key=lambda e: e["first_frame"]):
+            path = entry["path"]
+            if len(path) > TRACK_PATH_MAX_POINTS:
+                # Evenly decimate, always keeping the last point
+                stride = int(np.ceil(len(path) / TRACK_PATH_MAX_POINTS))
+                path = path[::stride] + ([path[-1]] if (len(path) - 1) % stride else [])
+            tracks.append({
+                "id": entry["id"],
+                "first_frame": entry["first_frame"],
+                "last_frame": entry["last_frame"],
+                "frames": entry["frames"],
+                "first_time": round(entry["first_frame"] / self.fps, 3),
+                "last_time": round(entry["last_frame"] / self.fps, 3),
+                "duration": round((entry["last_frame"] - entry["first_frame"] + 1) / self.fps, 3),
+                "path": path,
+            })
+        return {"type": "summary", "total_frames": total_frames, "fps": self.fps, "tracks": tracks}
+
+
+def encode_frame(fmt: str, frame_i: int, time_s: float, tracks: List[dict]) -> bytes:
+    if fmt == "binary":
+        parts = [_FRAME_HEADER.pack(frame_i, time_s, len(tracks))]
+        parts.extend(_TRACK_ENTRY.pack(t["id"], t["x1"], t["y1"], t["x2"], t["y2"]) for t in tracks)
+        return b"".join(parts)
+    record = {"type": "frame", "frame": frame_i, "time": round(time_s, 3), "tracks": tracks}
+    return (json.dumps(record) + "\n").encode()
+
+
+def encode_summary(fmt: str, summary: dict) -> bytes:
+    payload = json.dumps(summary).encode()
+    if fmt == "binary":
+        return _FRAME_HEADER.pack(SUMMARY_MARKER, 0.0, 0) + _LENGTH.pack(len(payload)) + payload
+    return payload + b"\n"
+
+
+def check_video(path: str) -> Optional[str]:
+    """
+    Open the video and decode its first frame; returns an error message if
+    that fails. Run before the response starts, while a status can still
+    be sent.
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return "Failed to open input video"
+        ret, _ = cap.read()
+        if not ret:
+            return "Input video has no decodable frames"
+        return None
+    finally:
+        cap.release()
+
+
+def resize_for_detection(frame: np.ndarray, max_width: int, max_height: int) -> np.ndarray:
+    """Shrink a decoded frame straight to detection resolution."""
+    height, width = frame.shape[:2]
+    if width <= max_width and height <= max_height:
+        return frame
+    scale = min(max_width / width, max_height / height)
+    return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def analyze_video(
+    path: str,
+    fmt: str,
+    max_width: int,
+    max_height: int,
+    start: float = 0.0,
+    end: Optional[float] = None,
+    sample_fps: Optional[float] = None
+) -> Iterator[bytes]:
+    """
+    Generator yielding encoded track records for every sampled frame between
+    ``start`` and ``end`` seconds of the video at ``path`` (to the end of the
+    stream when ``end`` is None), then the summary, or an error record if
+    processing fails. Meant to be wrapped in a StreamingResponse so results
+    reach the client while processing runs.
+    """
+    cap = cv2.VideoCapture(path)
+    stream_id = None
+    started = False
+    try:
+        if not cap.isOpened():
+            raise RuntimeError("❌ Failed to open input video")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        frame_range = FrameRange(fps, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), start, end, sample_fps)
+
+        # Every analysis has its own tracker; detection is batched with the
+        # other active video jobs
+        session = TrackingSession()
+        stream_id = stream_engine.open_stream()
+        summary = TrackSummary(fps)
+
+        if fmt == "binary":
+            started = True
+            yield BINARY_MAGIC
+
+        processed = 0
+        for frame_i, frame in iter_frames(cap, frame_range):
+            detection_img = resize_for_detection(frame, max_width, max_height)
+            del frame  # full-resolution pixels are not needed past this point
+
+            dets = stream_engine.submit(stream_id, detection_img).result()
+            track_results = track_objects(dets, detection_img, return_raw_detections=True, session=session)
+
+            h, w = detection_img.shape[:2]
+            tracks = [
+                {
+                    "id": int(track_id),
+                    "x1": float(x1 / w),
+                    "y1": float(y1 / h),
+                    "x2": float(x2 / w),
+                    "y2": float(y2 / h),
+                }
+                for x1, y1, x2, y2, track_id, _ in track_results
+            ]
+            summary.update(frame_i, tracks)
+            yield encode_frame(fmt, frame_i, frame_i / fps, tracks)
+            processed += 1
+
+        logger.info(f"✅ Tracks-only analysis finished: {processed} frames, {len(summary.tracks)} tracks")
+        yield encode_summary(fmt, summary.to_dict(processed))
+    except Exception as e:
+        # Headers are already sent; end the stream with an explicit error
+        logger.error(f"❌ Tracks-only analysis failed: {e}", exc_info=True)
+        if fmt == "binary" and not started:
+            yield BINARY_MAGIC
+        yield encode_summary(fmt, {"type": "error", "error": str(e)})
+    finally:
+        cap.release()
+        if stream_id is not None:
+            stream_engine.close_stream(stream_id)
+        try:
+            os.remove(path)
+        except Exception as e:
+            logger.warning(f"Could not remove input temp file: {e}")
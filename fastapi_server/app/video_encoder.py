@@ -0,0 +1,201 @@
+# video_encoder.py
+import os
+import abc
+import queue
+import shutil
+import threading
+import logging
+from typing import Optional, Tuple
+
+import cv2
+import ffmpeg
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Load configuration from environment variables
+VIDEO_ENCODER = os.getenv("VIDEO_ENCODER", "ffmpeg")  # "ffmpeg" (H.264) or "opencv" (mp4v)
+X264_PRESET = os.getenv("X264_PRESET", "veryfast")  # Speed/size trade-off of libx264
+X264_CRF = int(os.getenv("X264_CRF", "23"))  # Constant rate factor, lower = better quality
+X264_THREADS = int(os.getenv("X264_THREADS", "0"))  # 0 lets libx264 pick the thread count
+X264_FASTSTART = os.getenv("X264_FASTSTART", "1") == "1"  # Move moov atom up front for streaming
+ENCODER_QUEUE_SIZE = int(os.getenv("ENCODER_QUEUE_SIZE", "32"))  # Frames buffered ahead of the encoder
+
+ENCODERS = ("ffmpeg", "opencv")
+
+X264_PRESETS = (
+    "ultrafast", "superfast", "veryfast", "faster", "fast",
+    "medium", "slow", "slower", "veryslow",
+)
+
+DEFAULT_FPS = 30.0
+
+
+class VideoEncoder(abc.ABC):
+    """
+    Minimal writer interface shared by the encoder backends.
+    Mirrors the parts of cv2.VideoWriter used by the router.
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def isOpened(self) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def write(self, frame: np.ndarray):
+        ...
+
+    @abc.abstractmethod
+    def release(self):
+        ...
+
+
+class OpenCVEncoder(VideoEncoder):
+    """Legacy backend: cv2.VideoWriter with the mp4v fourcc."""
+
+    name = "opencv"
+
+    def __init__(self, path: str, fps: float, size: Tuple[int, int]):
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self._writer = cv2.VideoWriter(path, fourcc, fps, size)
+
+    def isOpened(self) -> bool:
+        return self._writer.isOpened()
+
+    def write(self, frame: np.ndarray):
+        self._writer.write(frame)
+
+    def release(self):
+        self._writer.release()
+
+
+class FFmpegEncoder(VideoEncoder):
+    """
+    Pipes raw BGR frames into an ffmpeg subprocess encoding H.264 (libx264).
+
+    Frames are handed to a background thread through a bounded queue, so
+    encoding runs concurrently with inference; the queue bound provides
+    backpressure when the encoder falls behind. write() and release()
+    block the calling thread, so async callers run them in an executor.
+    Frames passed to write() must not be modified afterwards.
+    """
+
+    name = "ffmpeg"
+
+    def __init__(
+        self,
+        path: str,
+        fps: float,
+        size: Tuple[int, int],
+        preset: str = X264_PRESET,
+        crf: int = X264_CRF,
+        threads: int = X264_THREADS,
+        faststart: bool = X264_FASTSTART,
+        queue_size: int = ENCODER_QUEUE_SIZE,
+    ):
+        if preset not in X264_PRESETS:
+            raise ValueError(f"Unknown x264 preset: {preset}")
+        self.size = size
+        width, height = size
+
+        output_kwargs = {
+            "vcodec": "libx264",
+            "preset": preset,
+            "crf": max(0, min(int(crf), 51)),
+            "pix_fmt": "yuv420p",
+            # yuv420p needs even dimensions
+            "vf": "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        }
+        if threads > 0:
+            output_kwargs["threads"] = threads
+        if faststart:
+            output_kwargs["movflags"] = "+faststart"
+
+        self._process = (
+            ffmpeg
+            .input("pipe:", format="rawvideo", pix_fmt="bgr24", s=f"{width}x{height}", framerate=fps)
+            .output(path, **output_kwargs)
+            .global_args("-loglevel", "error")
+            .overwrite_output()
+            .run_async(pipe_stdin=True)
+        )
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._error: Optional[BaseException] = None
+        self._released = False
+        self._thread = threading.Thread(target=self._pump, name="ffmpeg-encoder", daemon=True)
+        self._thread.start()
+
+    def _pump(self):
+        """Background loop feeding queued frames into ffmpeg's stdin."""
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error is not None:
+                continue  # keep draining so producers never block on a dead encoder
+            try:
+                self._process.stdin.write(data)
+            except Exception as e:
+                self._error = e
+                logger.error(f"❌ ffmpeg encoder pipe failed: {e}")
+
+    def isOpened(self) -> bool:
+        return self._process.poll() is None and self._error is None
+
+    def write(self, frame: np.ndarray):
+        if self._error is not None:
+            raise RuntimeError(f"ffmpeg encoder failed: {self._error}")
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size)
+        self._queue.put(np.ascontiguousarray(frame).tobytes())
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self._process.stdin.close()
+        except Exception:
+            pass
+        returncode = self._process.wait()
+        if returncode != 0:
+            logger.error(f"❌ ffmpeg exited with code {returncode}")
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def create_video_writer(
+    path: str,
+    fps: float,
+    size: Tuple[int, int],
+    encoder: Optional[str] = None,
+    preset: Optional[str] = None,
+    crf: Optional[int] = None,
+) -> VideoEncoder:
+    """
+    Create the configured encoder backend, falling back to OpenCV when the
+    ffmpeg binary is not installed.
+    """
+    encoder = encoder or VIDEO_ENCODER
+    fps = fps if fps and fps > 0 else DEFAULT_FPS
+
+    if encoder == "ffmpeg":
+        if ffmpeg_available():
+            return FFmpegEncoder(
+                path,
+                fps,
+                size,
+                preset=preset or X264_PRESET,
+                crf=X264_CRF if crf is None else crf,
+            )
+        logger.warning("ffmpeg binary not found; falling back to OpenCV mp4v encoder")
+    elif encoder not in ENCODERS:
+        raise ValueError(f"Unknown video encoder: {encoder}")
+
+    return OpenCVEncoder(path, fps, size)
@@ -0,0 +1,84 @@
+# video_io.py
+import logging
+from typing import Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRange:
+    """
+    Frame selection for a video: [start, end) in frame indices plus the
+    stride between sampled frames (fractional when sample_fps does not
+    divide the source fps). end is None when the range runs to the end of
+    the stream.
+
+    total_frames is the container's frame count, which is only an estimate
+    (it can be off, or 0, for some streams). It is used for len() and never
+    to stop decoding.
+    """
+
+    def __init__(self, fps: float, total_frames: int, start: float = 0.0,
+                 end: Optional[float] = None, sample_fps: Optional[float] = None):
+        self.fps = fps if fps and fps > 0 else 30.0
+        self.total_frames = max(0, total_frames)
+        self.start = max(0, int(round((start or 0.0) * self.fps)))
+        self.end = None if end is None else max(self.start, int(round(end * self.fps)))
+        if sample_fps and 0 < sample_fps < self.fps:
+            self.step = self.fps / sample_fps
+        else:
+            self.step = 1.0
+
+    @property
+    def output_fps(self) -> float:
+        return self.fps / self.step
+
+    def __len__(self) -> int:
+        """Estimated number of frames that will be sampled."""
+        end = self.total_frames if self.end is None else self.end
+        span = end - self.start
+        return int(np.ceil(span / self.step)) if span > 0 else 0
+
+
+def seek(cap: cv2.VideoCapture, frame_index: int) -> int:
+    """
+    Position cap on frame_index. The backend seeks to a nearby keyframe;
+    any remaining distance is covered with grab(), which skips colour
+    conversion and copying. Returns the frame position reached.
+    """
+    if frame_index <= 0:
+        return 0
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if position > frame_index:
+        # Backend overshot (inexact index); restart from the beginning
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        position = 0
+    while position < frame_index and cap.grab():
+        position += 1
+    return position
+
+
+def iter_frames(cap: cv2.VideoCapture, frames: FrameRange) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Yield (frame_index, frame) for the sampled frames of cap. Frames between
+    samples are only grabbed, never retrieved, so unused frames cost
+    demux/decode but no conversion or allocation. An open range is read
+    until the stream ends.
+    """
+    position = seek(cap, frames.start)
+    next_sample = float(frames.start)
+    while frames.end is None or position < frames.end:
+        if position < int(round(next_sample)):
+            if not cap.grab():
+                return
+            position += 1
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield position, frame
+        position += 1
+        next_sample += frames.step
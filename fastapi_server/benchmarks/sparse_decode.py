@@ -0,0 +1,86 @@
+# sparse_decode.py
+"""
+Compare full decoding against ranged/sparse decoding of a video.
+
+Usage (from fastapi_server/):
+
+    python -m benchmarks.sparse_decode clip.mp4 --start 60 --end 180 --sample-fps 2
+
+"full" reads every frame with cap.read() up to the end of the range, which is
+what /process_video did before ranges existed; "sparse" seeks to the start
+and grabs the frames between samples without retrieving them.
+"""
+import argparse
+import resource
+import time
+
+import cv2
+
+from app.video_io import FrameRange, iter_frames
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_full(path: str, frames: FrameRange) -> dict:
+    cap = cv2.VideoCapture(path)
+    start = time.perf_counter()
+    decoded = used = 0
+    next_sample = float(frames.start)
+    while frames.end is None or decoded < frames.end:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if decoded >= frames.start and decoded >= int(round(next_sample)):
+            used += 1
+            next_sample += frames.step
+        decoded += 1
+    cap.release()
+    return {"decoded": decoded, "used": used, "seconds": time.perf_counter() - start}
+
+
+def run_sparse(path: str, frames: FrameRange) -> dict:
+    cap = cv2.VideoCapture(path)
+    start = time.perf_counter()
+    used = 0
+    for _ in iter_frames(cap, frames):
+        used += 1
+    cap.release()
+    return {"decoded": used, "used": used, "seconds": time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--start", type=float, default=0.0, help="range start in seconds")
+    parser.add_argument("--end", type=float, default=None, help="range end in seconds")
+    parser.add_argument("--sample-fps", type=float, default=None, help="frames analysed per second")
+    parser.add_argument("--mode", choices=["both", "full", "sparse"], default="both",
+                        help="run one mode per process for a clean peak-RSS reading")
+    args = parser.parse_args()
+
+    cap = cv2.VideoCapture(args.path)
+    if not cap.isOpened():
+        raise SystemExit(f"Cannot open {args.path}")
+    frames = FrameRange(cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+                        args.start, args.end, args.sample_fps)
+    cap.release()
+    print(
+        f"Range: frames {frames.start}-{frames.end if frames.end is not None else 'end'}, "
+        f"~{len(frames)} sampled @ {frames.output_fps:.2f} fps"
+    )
+
+    modes = ["full", "sparse"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        result = (run_full if mode == "full" else run_sparse)(args.path, frames)
+        fps = result["used"] / result["seconds"] if result["seconds"] > 0 else 0.0
+        print(
+            f"{mode:>6}: {result['used']} frames used, {result['decoded']} retrieved, "
+            f"{result['seconds']:.2f}s, {fps:.1f} useful frames/s, peak RSS {peak_rss_mb():.0f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()